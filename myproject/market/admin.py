@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product
+from .models import Product, Order, OrderLine
 from django.contrib.auth.models import User
 import random
 
@@ -23,7 +23,22 @@ def create_test_products(modeladmin, request, queryset):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-        list_display = ("title", "seller", "brand", "price", "active", "created_at")     # columnas que ves en la lista
+        list_display = ("title", "seller", "brand", "price", "favorites_count", "active", "created_at")     # columnas que ves en la lista
         search_fields = ("title", "description", "brand", "seller__username")            # campos por los que podés buscar
         list_filter = ("active", "created_at", "seller")                                 # filtros en la barra lateral
-        actions = [create_test_products]
\ No newline at end of file
+        readonly_fields = ("favorites_count",)                                           # lo mantienen las signals
+        actions = [create_test_products]
+
+
+class OrderLineInline(admin.TabularInline):
+        model = OrderLine
+        extra = 0
+        readonly_fields = ("product", "title", "brand", "unit_price", "quantity", "subtotal")
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+        list_display = ("pk", "buyer_username", "status", "total", "quantity", "created_at")
+        list_filter = ("status",)
+        search_fields = ("buyer_username", "buyer_email", "payment_id")
+        readonly_fields = ("user", "payment_id", "paid_at", "buyer_username", "buyer_email", "total", "quantity", "line_count", "summary")  # copia del momento del checkout
+        inlines = [OrderLineInline]
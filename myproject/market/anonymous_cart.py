@@ -0,0 +1,103 @@
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.core import signing
+from .models import Product, CartItem, CartSummary
+from .inventory import OutOfStock, held_quantities
+
+# Visitors that aren't logged in keep their cart in a signed cookie
+# ({product id: quantity}), so browsing and filling the cart costs no database
+# writes. It doesn't hold stock: units are checked when added and held once the
+# cart is merged into the user's Cart at login (see market.signals).
+COOKIE_NAME = "anonymous_cart"
+COOKIE_SALT = "market.anonymous_cart"
+MAX_LINES = 50
+
+
+def read(request):
+    """Return the visitor's cart as {product_id: quantity}, empty if missing or tampered with"""
+    try:
+        raw = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT)
+    except signing.BadSignature:
+        return {}
+    if not raw:
+        return {}
+    try:
+        lines = {int(pk): int(quantity) for pk, quantity in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError):
+        return {}
+    return {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+
+
+def write(response, lines):
+    """Store the cart on the response, dropping the cookie when it is empty"""
+    lines = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+    if not lines:
+        clear(response)
+        return
+    response.set_signed_cookie(
+        COOKIE_NAME,
+        json.dumps({str(pk): quantity for pk, quantity in lines.items()}, separators=(",", ":")),
+        salt=COOKIE_SALT,
+        max_age=settings.ANONYMOUS_CART_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+        secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+def clear(response):
+    response.delete_cookie(COOKIE_NAME, samesite="Lax")
+
+
+def update(lines, quantities):
+    """
+    Return the cart with the new quantities applied, 0 removes the product.
+    Raised quantities are checked against the available units
+
+    Args:
+        lines: {product_id: quantity} as returned by read()
+        quantities: {Product: quantity}
+
+    Raises:
+        OutOfStock: A product doesn't have the units left (its product is attached)
+        ValueError: Negative quantity or too many products
+    """
+    lines = dict(lines)
+    held = held_quantities([product.pk for product in quantities])
+    for product, quantity in quantities.items():
+        if quantity < 0:
+            raise ValueError("quantity can't be negative")
+        if quantity > lines.get(product.pk, 0):
+            available = max(product.stock - held.get(product.pk, 0), 0) if product.active else 0
+            if quantity > available:
+                raise OutOfStock(available, product)
+        lines[product.pk] = quantity
+    lines = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+    if len(lines) > MAX_LINES:
+        raise ValueError(f"at most {MAX_LINES} products")
+    return lines
+
+
+def summary(lines):
+    """CartSummary of the anonymous cart, with unsaved items and a single product query"""
+    products = Product.objects.filter(pk__in=list(lines), active=True).order_by("pk")
+    items = []
+    for product in products:
+        item = CartItem(product=product, quantity=lines[product.pk])
+        item.line_subtotal = product.price * item.quantity
+        items.append(item)
+    return CartSummary(items, total=sum((item.line_subtotal for item in items), Decimal("0")))
+
+
+class AnonymousCartMiddleware:
+    """Drop the anonymous cart cookie once it has been merged at login"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, "anonymous_cart_merged", False):
+            clear(response)
+        return response
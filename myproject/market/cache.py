@@ -0,0 +1,84 @@
+import hashlib
+from .search import search_products
+from .utils import category_facets
+from django.conf import settings
+from django.core.cache import cache
+
+# Anonymous storefront fragments are keyed by their filters plus a generation
+# number per category. Saving/deleting a product bumps the generation of its
+# category and of the unfiltered listing, so only the pages it can show up in
+# are invalidated; stale entries just expire. Semantic grids also depend on the
+# product embeddings, rewritten in the background without bumping anything, so
+# they expire after SEMANTIC_CACHE_TIMEOUT instead.
+STOREFRONT_PREFIX = "storefront"
+ALL_CATEGORIES = "__all__"
+
+
+def _generation_key(category):
+    return f"{STOREFRONT_PREFIX}:gen:{category or ALL_CATEGORIES}"
+
+
+def storefront_cache_key(filters, cursor):
+    generation = cache.get_or_set(_generation_key(filters["category"]), 1, timeout=None)
+    params = "|".join(f"{name}={filters[name]}" for name in sorted(filters))
+    digest = hashlib.sha1(f"{params}|{cursor}".encode()).hexdigest()
+    return f"{STOREFRONT_PREFIX}:grid:{generation}:{digest}"
+
+
+def get_storefront_fragment(key):
+    return cache.get(key)
+
+
+def set_storefront_fragment(key, html, semantic=False):
+    timeout = settings.SEMANTIC_CACHE_TIMEOUT if semantic else settings.STOREFRONT_CACHE_TIMEOUT
+    cache.set(key, html, timeout)
+
+
+def invalidate_storefront(*categories):
+    """Bump the generation of the given categories and of the unfiltered storefront"""
+    for category in {ALL_CATEGORIES, *filter(None, categories)}:
+        key = _generation_key(category)
+        if not cache.add(key, 2, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(key, 2, timeout=None)
+
+
+def cached_category_facets(scope, search, products):
+    """
+    Per category counts for products matching search, cached for a short while
+
+    Args:
+        scope: Cache namespace of the products queryset ("storefront", "seller:<id>")
+        search: Current search term
+        products: Base queryset the counts are computed from on a miss
+    """
+    digest = hashlib.sha1(f"{scope}|{search}".encode()).hexdigest()
+    key = f"{STOREFRONT_PREFIX}:facets:{digest}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = category_facets(search_products(products, search) if search else products)
+        cache.set(key, facets, settings.FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+# Header counters of a logged in user, dropped by the cart, favorites and profile write paths
+NAVBAR_PREFIX = "navbar"
+
+
+def _navbar_key(user_id):
+    return f"{NAVBAR_PREFIX}:{user_id}"
+
+
+def get_navbar(user_id):
+    return cache.get(_navbar_key(user_id))
+
+
+def set_navbar(user_id, navbar):
+    cache.set(_navbar_key(user_id), navbar, settings.NAVBAR_CACHE_TIMEOUT)
+
+
+def invalidate_navbar(*user_ids):
+    cache.delete_many([_navbar_key(user_id) for user_id in user_ids if user_id])
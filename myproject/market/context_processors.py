@@ -0,0 +1,43 @@
+from django.db.models import Sum
+from django.utils.functional import SimpleLazyObject
+from profiles.models import Profile
+from . import anonymous_cart
+from .cache import get_navbar, set_navbar
+from .models import Product, CartItem
+
+
+def _user_navbar(user):
+    navbar = get_navbar(user.pk)
+    if navbar is None:
+        profile = Profile.objects.filter(user=user).only("avatar").first()
+        navbar = {
+            "cart_count": CartItem.objects.filter(cart__user=user).aggregate(
+                total=Sum("quantity", default=0)
+            )["total"],
+            "wishlist_count": Product.favorited_by.through.objects.filter(
+                user_id=user.pk, product__active=True
+            ).count(),
+            "avatar_url": profile.avatar.url if profile and profile.avatar else None,
+        }
+        set_navbar(user.pk, navbar)
+    return navbar
+
+
+def _anonymous_navbar(request):
+    return {
+        "cart_count": sum(anonymous_cart.read(request).values()),
+        "wishlist_count": 0,
+        "avatar_url": None,
+    }
+
+
+def navbar(request):
+    """
+    `navbar` with cart_count, wishlist_count and avatar_url for the header.
+    Users' values come from a per-user cache entry, visitors' cart from their cookie.
+    Nothing is computed unless the template uses it
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return {"navbar": SimpleLazyObject(lambda: _user_navbar(user))}
+    return {"navbar": SimpleLazyObject(lambda: _anonymous_navbar(request))}
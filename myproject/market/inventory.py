@@ -0,0 +1,342 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Product, Cart, CartItem, OrderLine
+from .cache import invalidate_storefront, invalidate_navbar
+
+# Adding to the cart doesn't touch Product: the cart item holds its units for
+# CART_HOLD_TTL seconds, and available stock is on-hand stock minus live holds.
+# Holds are checked with the product row locked, so two buyers can't hold the same
+# unit. Stock only goes down when an order is paid (commit_orders), with the product
+# rows locked and lines that no longer fit left out. Expired holds simply stop
+# counting; release_expired_holds clears them in bulk.
+
+
+class OutOfStock(Exception):
+    """Raised when a product doesn't have the requested units left"""
+
+    def __init__(self, available, product=None):
+        super().__init__(f"Only {available} units available")
+        self.available = available
+        self.product = product
+
+
+def _cart_changed(*user_ids, products=()):
+    # The header shows the number of units in the cart, and the cached storefront grids
+    # the units still available of the products whose holds changed
+    categories = {product.category for product in products}
+
+    def invalidate():
+        invalidate_navbar(*user_ids)
+        if categories:
+            invalidate_storefront(*categories)
+    transaction.on_commit(invalidate)
+
+
+def hold_expiry():
+    return timezone.now() + timedelta(seconds=settings.CART_HOLD_TTL)
+
+
+def live_holds():
+    return CartItem.objects.filter(held_until__gt=timezone.now())
+
+
+def held_quantities(product_ids, exclude_item=None):
+    """{product_id: units held by live holds} for the given products, in one query"""
+    holds = live_holds().filter(product_id__in=product_ids)
+    if exclude_item is not None:
+        holds = holds.exclude(pk=exclude_item.pk)
+    return dict(
+        holds.order_by().values("product_id").annotate(held=Sum("quantity")).values_list("product_id", "held")
+    )
+
+
+def available_stock(product, exclude_item=None):
+    """Units of the product that can still be held, optionally ignoring one cart item's own hold"""
+    held = held_quantities([product.pk], exclude_item).get(product.pk, 0)
+    return max(product.stock - held, 0)
+
+
+def _check_available(product, quantity, item=None):
+    """Lock the product row and make sure quantity units can be held for item"""
+    product.stock = Product.objects.select_for_update().values_list("stock", flat=True).get(pk=product.pk)
+    available = available_stock(product, exclude_item=item)
+    if quantity > available:
+        raise OutOfStock(available, product)
+
+
+def _locked_cart(user):
+    cart, created = Cart.objects.get_or_create(user=user)
+    return Cart.objects.select_for_update().get(pk=cart.pk)
+
+
+@transaction.atomic
+def add_to_cart(user, product, quantity=1):
+    """
+    Hold quantity more units of the product in the user's cart
+
+    Raises:
+        OutOfStock: Not enough units left, nothing was changed
+    """
+    if quantity < 1:
+        raise ValueError("quantity must be positive")
+    cart = _locked_cart(user)
+    item = CartItem.objects.filter(cart=cart, product=product).first()
+    new_quantity = quantity + (item.quantity if item else 0)
+    _check_available(product, new_quantity, item)
+
+    _cart_changed(user.pk, products=[product])
+    if item is None:
+        return CartItem.objects.create(cart=cart, product=product, quantity=new_quantity, held_until=hold_expiry())
+    item.quantity = new_quantity
+    item.held_until = hold_expiry()
+    item.save(update_fields=["quantity", "held_until"])
+    return item
+
+
+@transaction.atomic
+def change_quantity(user, product, delta):
+    """
+    Add (delta > 0) or remove (delta < 0) units of a product already in the cart,
+    keeping at least one unit. The hold is renewed
+
+    Raises:
+        CartItem.DoesNotExist: The product isn't in the cart
+        OutOfStock: Not enough units left to increase (or to hold again an expired item)
+        ValueError: Decreasing below one unit
+    """
+    cart = _locked_cart(user)
+    item = CartItem.objects.get(cart=cart, product=product)
+    new_quantity = item.quantity + delta
+    if new_quantity < 1:
+        raise ValueError("quantity can't go below 1")
+    if delta > 0 or not item.is_held():
+        _check_available(product, new_quantity, item)
+
+    item.quantity = new_quantity
+    item.held_until = hold_expiry()
+    item.save(update_fields=["quantity", "held_until"])
+    _cart_changed(user.pk, products=[product])
+    return item
+
+
+@transaction.atomic
+def remove_from_cart(user, product):
+    """
+    Delete the product from the cart, which releases its hold
+
+    Raises:
+        CartItem.DoesNotExist: The product isn't in the cart
+    """
+    cart = _locked_cart(user)
+    item = CartItem.objects.get(cart=cart, product=product)
+    item.delete()
+    _cart_changed(user.pk, products=[product])
+    return item
+
+
+@transaction.atomic
+def set_quantities(user, quantities):
+    """
+    Set the cart quantity of several products at once, 0 removes the product.
+    Either every change is applied or none
+
+    Args:
+        quantities: {Product: quantity}
+
+    Returns:
+        {product id: CartItem, or None when it was removed}
+
+    Raises:
+        OutOfStock: A product doesn't have the units left (its product is attached)
+        ValueError: Negative quantity
+    """
+    cart = _locked_cart(user)
+    items = {item.product_id: item for item in CartItem.objects.filter(cart=cart, product__in=list(quantities))}
+    result = {}
+    # Products are locked in id order so concurrent updates can't deadlock
+    for product in sorted(quantities, key=lambda product: product.pk):
+        quantity = quantities[product]
+        item = items.get(product.pk)
+        if quantity < 0:
+            raise ValueError("quantity can't be negative")
+        if quantity == 0:
+            if item is not None:
+                item.delete()
+            result[product.pk] = None
+            continue
+
+        if item is None or quantity > item.quantity or not item.is_held():
+            _check_available(product, quantity, item)
+        if item is None:
+            item = CartItem.objects.create(cart=cart, product=product, quantity=quantity, held_until=hold_expiry())
+        else:
+            item.quantity = quantity
+            item.held_until = hold_expiry()
+            item.save(update_fields=["quantity", "held_until"])
+        result[product.pk] = item
+    _cart_changed(user.pk, products=quantities)
+    return result
+
+
+@transaction.atomic
+def merge_cart(user, lines):
+    """
+    Merge an anonymous cart into the user's cart with one bulk upsert.
+    Quantities add up with the ones already in the cart and are capped to the
+    units available; products no longer sold are dropped
+
+    Args:
+        lines: {product_id: quantity}
+
+    Returns:
+        [(Product, wanted, merged)] for the lines that had to be reduced
+    """
+    if not lines:
+        return []
+    cart = _locked_cart(user)
+    # Locked in id order so concurrent checkouts can't deadlock
+    products = list(
+        Product.objects.select_for_update().filter(pk__in=list(lines), active=True).order_by("pk")
+    )
+    existing = {item.product_id: item for item in CartItem.objects.filter(cart=cart, product__in=products)}
+    held = held_quantities([product.pk for product in products])
+    expiry = hold_expiry()
+
+    merged = []
+    conflicts = []
+    for product in products:
+        item = existing.get(product.pk)
+        in_cart = item.quantity if item else 0
+        own_hold = in_cart if item and item.is_held() else 0
+        available = max(product.stock - held.get(product.pk, 0) + own_hold, 0)
+        wanted = lines[product.pk] + in_cart
+        quantity = min(wanted, available)
+        if quantity < wanted:
+            conflicts.append((product, wanted, quantity))
+        if quantity:
+            merged.append(CartItem(cart=cart, product=product, quantity=quantity, held_until=expiry))
+
+    CartItem.objects.bulk_create(
+        merged,
+        update_conflicts=True,
+        unique_fields=["cart", "product"],
+        update_fields=["quantity", "held_until"],
+    )
+    _cart_changed(user.pk, products=products)
+    return conflicts
+
+
+@transaction.atomic
+def renew_holds(cart):
+    """
+    Hold every item of the cart again for a full TTL, e.g. before paying
+
+    Raises:
+        OutOfStock: An item no longer fits in the available stock (its product is attached)
+    """
+    cart = Cart.objects.select_for_update().get(pk=cart.pk)
+    # Products are locked in id order so concurrent checkouts can't deadlock
+    items = list(CartItem.objects.filter(cart=cart).select_related("product").order_by("product_id"))
+    for item in items:
+        _check_available(item.product, item.quantity, item)
+    CartItem.objects.filter(pk__in=[item.pk for item in items]).update(held_until=hold_expiry())
+    _cart_changed(cart.user_id, products=[item.product for item in items])
+    return items
+
+
+@transaction.atomic
+def commit_orders(orders):
+    """
+    Take the units of several paid orders out of stock and out of their buyers' carts, in
+    a fixed number of queries whatever the number of orders
+
+    Only the order lines are taken, as frozen at checkout: items added to the cart after
+    the buyer was sent to pay stay in it. Products are locked and their new stock written
+    with one bulk UPDATE, so stock never goes negative: a line that no longer fits is
+    left out and reported.
+
+    Returns:
+        {order id: (fulfilled OrderLines, OrderLines left out because stock ran out)}
+    """
+    user_of = {order.pk: order.user_id for order in orders}
+    # Carts and products are locked in id order so concurrent checkouts can't deadlock
+    carts = {
+        cart.pk: cart.user_id
+        for cart in Cart.objects.select_for_update().filter(user_id__in=set(user_of.values())).order_by("pk")
+    }
+    lines = list(OrderLine.objects.filter(order_id__in=user_of).order_by("order_id", "product_id"))
+    products = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(
+            pk__in={line.product_id for line in lines}
+        ).only("stock", "category").order_by("pk")
+    }
+
+    results = {order_id: ([], []) for order_id in user_of}
+    paid_units = defaultdict(int)  # (user id, product id) -> units
+    for line in lines:
+        product = products.get(line.product_id)
+        fulfilled, shortages = results[line.order_id]
+        if product is not None and product.stock >= line.quantity:
+            product.stock -= line.quantity
+            fulfilled.append(line)
+        else:
+            shortages.append(line)
+        paid_units[user_of[line.order_id], line.product_id] += line.quantity
+    Product.objects.bulk_update(products.values(), ["stock"])
+
+    # The paid units leave the cart along with their holds, whatever else it holds now stays
+    emptied, reduced = [], []
+    for item in CartItem.objects.filter(cart_id__in=carts, product_id__in=products):
+        units = paid_units.get((carts[item.cart_id], item.product_id), 0)
+        if item.quantity <= units:
+            emptied.append(item.pk)
+        elif units:
+            item.quantity -= units
+            reduced.append(item)
+    CartItem.objects.filter(pk__in=emptied).delete()
+    CartItem.objects.bulk_update(reduced, ["quantity"])
+    # bulk_update() skips post_save, so the cached storefront grids are invalidated here
+    _cart_changed(*carts.values(), products=products.values())
+    return results
+
+
+def release_expired_holds(batch_size=1000):
+    """Clear expired holds in batches. Returns how many were released"""
+    released = 0
+    categories = set()
+    now = timezone.now()
+    while True:
+        rows = list(
+            CartItem.objects.filter(held_until__lte=now).values_list("pk", "product__category")[:batch_size]
+        )
+        if not rows:
+            break
+        with transaction.atomic():
+            # Holds renewed since the SELECT are left alone, only the rows still expired are released
+            expired = list(
+                CartItem.objects.select_for_update(of=("self",))
+                .filter(pk__in=[pk for pk, category in rows], held_until__lte=now)
+                .values_list("pk", "product__category")
+            )
+            released += CartItem.objects.filter(
+                pk__in=[pk for pk, category in expired], held_until__lte=now
+            ).update(held_until=None)
+        categories.update(category for pk, category in expired)
+    # Cached grids rendered while the holds were live still show their units as taken
+    if categories:
+        invalidate_storefront(*categories)
+    return released
+
+
+def attach_available_stock(products):
+    """Set `available` (on-hand stock minus live holds) on every product with a single query"""
+    products = list(products)
+    held = held_quantities([product.pk for product in products]) if products else {}
+    for product in products:
+        product.available = max(product.stock - held.get(product.pk, 0), 0)
+    return products
@@ -0,0 +1,172 @@
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, close_old_connections
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from market import payments
+from market.models import Product, Cart, CartItem, PaymentNotification
+from market.payments import finalize_payments
+from market.views import process_cart_payment, mercadopago_webhook
+from .fake_mercadopago import start_server, webhook_headers
+
+WEBHOOK_SECRET = "bench-checkout"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure checkout throughput against a local fake Mercado Pago: first clicks create "
+        "preferences, repeat clicks on unchanged carts should reuse them, then every cart is paid "
+        "and a burst of duplicated webhooks is queued and finalized in batches "
+        "(creates and then deletes its own users and products)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--buyers", type=int, default=20)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--clicks", type=int, default=5, help="Pay clicks per buyer after the first one")
+        parser.add_argument("--latency", type=float, default=0.15, help="Seconds the fake API takes per call")
+        parser.add_argument("--webhook-copies", type=int, default=3, help="Deliveries of every payment notification")
+        parser.add_argument("--batch-size", type=int, default=100, help="Payments finalized per batch")
+
+    def handle(self, *args, **options):
+        server = start_server(latency=options["latency"])
+        tag = random.randint(0, 10**9)
+        seller = User.objects.create(username=f"bench-seller-{tag}")
+        buyers = [User.objects.create(username=f"bench-buyer-{tag}-{i}") for i in range(options["buyers"])]
+        products = Product.objects.bulk_create([
+            Product(seller=seller, title=f"Bench {i}", price=100 + i, category="other", stock=10**6)
+            for i in range(5)
+        ])
+        ordered = {product.pk: 0 for product in products}
+        for buyer in buyers:
+            cart = Cart.objects.create(user=buyer)
+            items = CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=random.randint(1, 3)) for product in products
+            ])
+            for item in items:
+                ordered[item.product_id] += item.quantity
+
+        factory = RequestFactory()
+        host = next((host for host in settings.ALLOWED_HOSTS if not host.startswith((".", "*"))), "localhost")
+
+        init_points = {}
+
+        def click(buyer):
+            request = factory.post(reverse("market:process_cart_payment"), HTTP_HOST=host)
+            request.user = buyer
+            response = process_cart_payment(request)
+            if response.status_code == 200:
+                init_points[buyer.pk] = json.loads(response.content)["init_point"]
+            return response
+
+        def notify(payment_id):
+            request = factory.post(
+                f"{reverse('market:mercadopago_webhook')}?data.id={payment_id}&type=payment",
+                data={"type": "payment", "data": {"id": payment_id}},
+                content_type="application/json",
+                HTTP_HOST=host,
+                headers=webhook_headers(WEBHOOK_SECRET, payment_id),
+            )
+            return mercadopago_webhook(request)
+
+        def run(call, work):
+            """Send every request of work through call, spread over the threads. Returns (seconds, failures)"""
+            failures = []
+            lock = threading.Lock()
+
+            def worker(chunk):
+                try:
+                    for argument in chunk:
+                        response = call(argument)
+                        if response.status_code != 200:
+                            with lock:
+                                failures.append(response.content.decode())
+                finally:
+                    connection.close()
+
+            threads = [
+                threading.Thread(target=worker, args=(work[i::options["threads"]],))
+                for i in range(options["threads"])
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            close_old_connections()
+            return time.perf_counter() - start, failures
+
+        def report(label, count, unit, elapsed):
+            self.stdout.write(
+                f"{label:<14} {count:>5} {unit:<9} {elapsed:7.2f}s  {count / elapsed:8.1f} {unit}/s"
+            )
+
+        stock_before = dict(Product.objects.filter(pk__in=list(ordered)).values_list("pk", "stock"))
+        try:
+            with override_settings(MERCADOPAGO_API_URL=server.url, MERCADOPAGO_WEBHOOK_SECRET=WEBHOOK_SECRET):
+                payments.get_sdk.cache_clear()
+                cache.clear()
+                elapsed, failures = run(click, buyers)
+                report("First click", len(buyers), "clicks", elapsed)
+                created = server.stats.get("preference", 0)
+                if not failures and options["clicks"]:
+                    elapsed, failures = run(click, buyers * options["clicks"])
+                    report("Repeat clicks", len(buyers) * options["clicks"], "clicks", elapsed)
+
+                if not failures:
+                    # Every buyer pays, then the notifications arrive all at once, duplicated
+                    payment_ids = []
+                    for buyer in buyers:
+                        location = requests.get(init_points[buyer.pk], allow_redirects=False).headers["Location"]
+                        payment_ids.append(parse_qs(urlsplit(location).query)["payment_id"][0])
+                    burst = payment_ids * options["webhook_copies"]
+                    random.shuffle(burst)
+                    elapsed, failures = run(notify, burst)
+                    report("Webhooks", len(burst), "requests", elapsed)
+
+                    start = time.perf_counter()
+                    finalized = 0
+                    while True:
+                        batch = finalize_payments(options["batch_size"])
+                        finalized += len(batch)
+                        if len(batch) < options["batch_size"]:
+                            break
+                    report("Finalized", finalized, "payments", time.perf_counter() - start)
+
+                    results = dict(
+                        PaymentNotification.objects.filter(payment_id__in=payment_ids)
+                        .values_list("payment_id", "result")
+                    )
+                    stock_after = dict(Product.objects.filter(pk__in=list(ordered)).values_list("pk", "stock"))
+                    left_in_carts = CartItem.objects.filter(cart__user__in=buyers).count()
+        finally:
+            payments.get_sdk.cache_clear()
+            server.shutdown()
+            server.server_close()
+            Cart.objects.filter(user__in=buyers).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            User.objects.filter(pk__in=[seller.pk] + [buyer.pk for buyer in buyers]).delete()
+
+        if failures:
+            raise CommandError(f"{len(failures)} checkout(s) failed, first error: {failures[0]}")
+        repeats = server.stats.get("preference", 0) - created
+        self.stdout.write(f"Preferences created: {created} on first clicks, {repeats} on repeat clicks")
+        if repeats:
+            raise CommandError("Repeat clicks on unchanged carts created new preferences")
+        if finalized != len(buyers) or set(results.values()) != {"approved"}:
+            raise CommandError(f"{finalized} payment(s) finalized for {len(buyers)} buyers: {results}")
+        taken = {pk: stock_before[pk] - stock_after[pk] for pk in ordered}
+        if taken != ordered or left_in_carts:
+            raise CommandError(f"Took {taken} out of stock for {ordered} ordered, {left_in_carts} item(s) left in carts")
+        self.stdout.write(self.style.SUCCESS(
+            "Repeat clicks reused the cached preferences, every payment was finalized exactly once"
+        ))
@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from market.models import Product
+from market.search import search_products, index_products
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "zo"]
+BRANDS = ["Generico", "Acmé", "Nórdica", "Pampa", "Andes", "Litoral"]
+# Needle products are only seeded once, so the result set keeps its size as the catalog grows
+NEEDLES = [
+    ("Lámpara de pie clásica", "Lámpara eléctrica de pie con pantalla de tela"),
+    ("Teléfono celular azul", "Teléfono liberado con batería de larga duración"),
+    ("Zapatillas de running", "Zapatillas livianas para correr"),
+    ("Guitarra clásica", "Guitarra de estudio con cuerdas de nylon"),
+]
+NEEDLES_PER_PRODUCT = 25
+QUERIES = ["lampara", "telefono azul", "zapatilla", "bateria", "guitarras clasicas"]
+
+
+class Command(BaseCommand):
+    help = "Compare icontains vs full-text search latency as the catalog grows (changes are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--max-growth", type=float, default=None,
+            help="Fail if full-text latency at the largest size exceeds the smallest one by this factor",
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(options["sizes"])
+        results = []
+        with transaction.atomic():
+            seller = User.objects.create(username=f"bench-search-{random.randint(0, 10**9)}")
+            rng = random.Random(0)
+            created = 0
+            for size in sizes:
+                self._seed(rng, seller, size - created, needles=not created)
+                created = size
+                icontains = self._time(self._icontains, options["repeat"])
+                fulltext = self._time(self._fulltext, options["repeat"])
+                results.append((size, icontains, fulltext))
+                self.stdout.write(
+                    f"{size:>9} products  icontains {icontains:8.2f} ms  full-text {fulltext:8.2f} ms"
+                )
+            transaction.set_rollback(True)
+
+        growth = results[-1][2] / max(results[0][2], 0.001)
+        self.stdout.write(f"Full-text latency growth {sizes[0]} -> {sizes[-1]} products: x{growth:.2f}")
+        if options["max_growth"] is not None and growth > options["max_growth"]:
+            raise CommandError(f"Full-text latency grew x{growth:.2f} (limit x{options['max_growth']})")
+
+    def _word(self, rng):
+        return "".join(rng.choices(SYLLABLES, k=4))
+
+    def _seed(self, rng, seller, count, needles):
+        if count <= 0:
+            return
+        products = []
+        for i in range(count):
+            if needles and i < NEEDLES_PER_PRODUCT * len(NEEDLES):
+                title, description = NEEDLES[i % len(NEEDLES)]
+            else:
+                title = " ".join(self._word(rng) for _ in range(3))
+                description = " ".join(self._word(rng) for _ in range(20))
+            products.append(Product(
+                seller=seller,
+                title=title,
+                description=description,
+                brand=rng.choice(BRANDS),
+                price=rng.randint(100, 100000),
+            ))
+        # bulk_create skips signals, so index the new rows explicitly
+        for start in range(0, count, 2000):
+            batch = Product.objects.bulk_create(products[start:start + 2000])
+            index_products((p.id, p.title, p.description, p.brand) for p in batch)
+
+    def _icontains(self, query):
+        return list(Product.objects.filter(active=True).filter(
+            Q(title__icontains=query) | Q(description__icontains=query) | Q(brand__icontains=query)
+        ).order_by("-created_at")[:12])
+
+    def _fulltext(self, query):
+        return list(search_products(Product.objects.filter(active=True), query)
+                    .order_by("-search_rank", "-created_at")[:12])
+
+    def _time(self, search, repeat):
+        timings = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                start = time.perf_counter()
+                search(query)
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
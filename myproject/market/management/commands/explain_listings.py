@@ -0,0 +1,94 @@
+import random
+import re
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from market.models import Product
+from market.pagination import product_listing_paginator, SORT_ORDERINGS
+from market.search import index_products
+
+# Plan lines that mean the products table is read row by row
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on market_product\b"),
+    "sqlite": re.compile(r"\bSCAN market_product\b(?! USING)"),
+}
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN every market listing query against a seeded catalog and fail on sequential scans (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20000)
+        parser.add_argument("--sellers", type=int, default=50)
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan")
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Unsupported database backend: {connection.vendor}")
+
+        failures = []
+        with transaction.atomic():
+            sellers = self._seed(options["products"], options["sellers"])
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            for name, queryset in self._listing_queries(sellers[0]):
+                plan = queryset.explain()
+                has_seq_scan = bool(pattern.search(plan))
+                status = self.style.ERROR("SEQ SCAN") if has_seq_scan else self.style.SUCCESS("ok")
+                self.stdout.write(f"{name:<40} {status}")
+                if has_seq_scan or options["verbose_plans"]:
+                    self.stdout.write(plan)
+                if has_seq_scan:
+                    failures.append(name)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"Sequential scans in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("Every listing query uses an index"))
+
+    def _listing_queries(self, user):
+        """Same querysets product_list and my_product_list build, first page and a following one"""
+        storefront = Product.objects.filter(active=True)
+        shapes = [
+            ("storefront", storefront, "", "", ""),
+            ("storefront (logged in)", storefront.exclude(seller=user), "", "", ""),
+            ("storefront category", storefront, "electronics", "", ""),
+            ("storefront search", storefront, "", "lampara", ""),
+            ("my products", Product.objects.filter(active=True, seller=user), "", "", ""),
+            ("my products category", Product.objects.filter(active=True, seller=user), "books", "", ""),
+        ]
+        shapes += [(f"storefront sort={sort}", storefront, "", "", sort) for sort in SORT_ORDERINGS]
+        for name, products, category, search, sort in shapes:
+            paginator = product_listing_paginator(products, category, search, sort)
+            first_page, _ = paginator.page_queryset()
+            yield f"{name}: first page", first_page
+            rows = list(first_page)
+            if rows:
+                cursor = paginator.make_cursor(rows[min(len(rows), paginator.per_page) - 1], "next")
+                yield f"{name}: next page", paginator.page_queryset(cursor)[0]
+            yield f"{name}: count", paginator.queryset.order_by(*paginator.ordering)[:1001]
+
+    def _seed(self, count, seller_count):
+        rng = random.Random(0)
+        tag = rng.randint(0, 10**9)
+        sellers = [User.objects.create(username=f"explain-{tag}-{i}") for i in range(seller_count)]
+        categories = [value for value, _ in Product.CATEGORY_CHOICES]
+        words = ["lámpara", "mesa", "silla", "teléfono", "libro", "pelota", "reloj", "campera"]
+        for start in range(0, count, 2000):
+            batch = Product.objects.bulk_create([
+                Product(
+                    seller=rng.choice(sellers),
+                    title=f"{rng.choice(words)} {start + i}",
+                    description=" ".join(rng.choices(words, k=8)),
+                    price=rng.randint(100, 100000),
+                    category=rng.choice(categories),
+                    stock=rng.randint(0, 50),
+                    favorites_count=rng.randint(0, 500),
+                    active=rng.random() > 0.1,
+                )
+                for i in range(min(2000, count - start))
+            ])
+            index_products((p.id, p.title, p.description, p.brand) for p in batch)
+        return sellers
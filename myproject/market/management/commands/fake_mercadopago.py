@@ -0,0 +1,210 @@
+import hashlib
+import hmac
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlsplit
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Stand-in for the parts of the Mercado Pago API the market uses, to load test
+# checkout offline. Point the app at it with MERCADOPAGO_API_URL=http://127.0.0.1:8765
+#   POST /checkout/preferences       create a preference, returns its init_point
+#   GET  /checkout/pay/<preference>  "pay" it: redirects to back_urls.success with a payment_id
+#   GET  /v1/payments/<id>           the approved payment, with the preference's external_reference
+#   GET  /__stats                    requests served per endpoint
+# With --webhook-url every payment is also notified there, signed like Mercado Pago does.
+PAYMENT_RE = re.compile(r"^/v1/payments/(\d+)$")
+PAY_RE = re.compile(r"^/checkout/pay/([\w-]+)$")
+
+
+def webhook_headers(secret, payment_id):
+    """x-signature and x-request-id headers of a Mercado Pago payment notification"""
+    request_id = str(uuid.uuid4())
+    ts = str(int(time.time() * 1000))
+    manifest = f"id:{str(payment_id).lower()};request-id:{request_id};ts:{ts};"
+    signature = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return {"x-signature": f"ts={ts},v1={signature}", "x-request-id": request_id}
+
+
+class FakeMercadoPagoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, webhook_url=None, webhook_secret="", webhook_copies=1):
+        super().__init__(address, FakeMercadoPagoHandler)
+        self.latency = latency
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        # Mercado Pago may deliver the same notification more than once
+        self.webhook_copies = webhook_copies
+        self.preferences = {}
+        self.payments = {}
+        self.stats = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint):
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def notify(self, payment_id):
+        """POST the payment notifications to the webhook, in the background"""
+        def send():
+            for _ in range(self.webhook_copies):
+                try:
+                    requests.post(
+                        f"{self.webhook_url}?{urlencode({'data.id': payment_id, 'type': 'payment'})}",
+                        json={"action": "payment.created", "type": "payment", "data": {"id": str(payment_id)}},
+                        headers=webhook_headers(self.webhook_secret, payment_id),
+                        timeout=10,
+                    )
+                    self.count("webhook")
+                except requests.RequestException:
+                    self.count("webhook_error")
+
+        if self.webhook_url:
+            threading.Thread(target=send, daemon=True).start()
+
+
+class FakeMercadoPagoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def do_POST(self):
+        server = self.server
+        path = urlsplit(self.path).path
+        data = self._read_json()
+        if path != "/checkout/preferences":
+            self._send(404, {"message": "not found"})
+            return
+        server.count("preference")
+        if not data or not data.get("items"):
+            self._send(400, {"message": "items needed"})
+            return
+        time.sleep(server.latency)
+
+        with server.lock:
+            preference_id = f"fake-{next(server.ids)}"
+            server.preferences[preference_id] = data
+        init_point = f"{server.url}/checkout/pay/{preference_id}"
+        self._send(201, {"id": preference_id, "init_point": init_point, "sandbox_init_point": init_point})
+
+    def do_GET(self):
+        server = self.server
+        path = urlsplit(self.path).path
+
+        if path == "/__stats":
+            with server.lock:
+                self._send(200, dict(server.stats))
+            return
+
+        match = PAY_RE.match(path)
+        if match:
+            server.count("pay")
+            preference = server.preferences.get(match[1])
+            if preference is None:
+                self._send(404, {"message": "preference not found"})
+                return
+            with server.lock:
+                payment_id = next(server.ids)
+                server.payments[payment_id] = {
+                    "id": payment_id,
+                    "status": "approved",
+                    "external_reference": preference.get("external_reference"),
+                    "preference_id": match[1],
+                    "transaction_amount": sum(
+                        item["quantity"] * item["unit_price"] for item in preference["items"]
+                    ),
+                }
+            query = urlencode({
+                "payment_id": payment_id,
+                "status": "approved",
+                "external_reference": preference.get("external_reference") or "",
+                "preference_id": match[1],
+            })
+            server.notify(payment_id)
+            success = preference.get("back_urls", {}).get("success", "/")
+            self._send(302, headers={"Location": f"{success}?{query}"})
+            return
+
+        match = PAYMENT_RE.match(path)
+        if match:
+            server.count("payment")
+            time.sleep(server.latency)
+            payment = server.payments.get(int(match[1]))
+            if payment is None:
+                self._send(404, {"message": "payment not found", "status": 404})
+            else:
+                self._send(200, payment)
+            return
+
+        self._send(404, {"message": "not found"})
+
+
+def start_server(port=0, latency=0.0, **webhook):
+    """Run a fake Mercado Pago in a background thread, port 0 picks a free one"""
+    server = FakeMercadoPagoServer(("127.0.0.1", port), latency=latency, **webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the Mercado Pago API, for offline checkout load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--latency", type=float, default=0.15,
+            help="Seconds added to every API call, roughly what the real API takes",
+        )
+        parser.add_argument(
+            "--webhook-url",
+            help="Notify payments there, e.g. http://127.0.0.1:8000/products/cart/checkout/webhook/",
+        )
+        parser.add_argument("--webhook-copies", type=int, default=1, help="Deliveries of every notification")
+
+    def handle(self, *args, **options):
+        server = FakeMercadoPagoServer(
+            ("127.0.0.1", options["port"]),
+            latency=options["latency"],
+            webhook_url=options["webhook_url"],
+            webhook_secret=settings.MERCADOPAGO_WEBHOOK_SECRET,
+            webhook_copies=options["webhook_copies"],
+        )
+        self.stdout.write(f"Fake Mercado Pago on {server.url} (set MERCADOPAGO_API_URL={server.url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Requests served: {server.stats}")
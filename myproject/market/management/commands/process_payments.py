@@ -0,0 +1,34 @@
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from market.payments import finalize_payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Finalize the queued Mercado Pago payments in batches: take the paid units out of stock "
+        "and empty the carts (run it periodically, or keep it running with --every)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--fetch-workers", type=int, default=8, help="Concurrent Mercado Pago lookups")
+        parser.add_argument(
+            "--every", type=float, default=None,
+            help="Keep running and poll the queue every this many seconds instead of draining it once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            results = Counter()
+            while True:
+                notifications = finalize_payments(options["batch_size"], fetch_workers=options["fetch_workers"])
+                results.update(notification.result or "retry later" for notification in notifications)
+                if len(notifications) < options["batch_size"]:
+                    break
+            if results or not options["every"]:
+                summary = ", ".join(f"{count} {result}" for result, count in sorted(results.items()))
+                self.stdout.write(self.style.SUCCESS(f"Payments: {summary or 'none queued'}"))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from market.models import Product
+from market.utils import favorites_count_subquery
+
+
+class Command(BaseCommand):
+    help = "Rebuild Product.favorites_count from the favorites table in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report the drifted products")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = (
+                Product.objects.annotate(actual=favorites_count_subquery())
+                .exclude(favorites_count=F("actual"))
+            )
+            total = drifted.count()
+            if not options["dry_run"] and total:
+                Product.objects.filter(pk__in=drifted.values("pk")).update(
+                    favorites_count=favorites_count_subquery()
+                )
+
+        verb = "would be fixed" if options["dry_run"] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{total} product(s) with a drifted favorites_count {verb}"))
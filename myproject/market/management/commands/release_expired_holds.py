@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from market.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Release the expired cart stock holds in bulk (run it periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--every", type=int, default=None,
+            help="Keep running and sweep every this many seconds instead of once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds(options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"{released} expired hold(s) released"))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
@@ -0,0 +1,92 @@
+import random
+import threading
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, close_old_connections
+from market import inventory
+from market.models import Product, Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one product with concurrent add/increase/decrease/remove cart operations and "
+        "check that live holds never exceed the on-hand stock and that cart clicks never change it "
+        "(creates and then deletes its own users and product)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--operations", type=int, default=200, help="Operations per thread")
+        parser.add_argument("--stock", type=int, default=50)
+
+    def handle(self, *args, **options):
+        tag = random.randint(0, 10**9)
+        seller = User.objects.create(username=f"stress-seller-{tag}")
+        buyers = [User.objects.create(username=f"stress-buyer-{tag}-{i}") for i in range(options["threads"])]
+        product = Product.objects.create(
+            seller=seller, title="Stress test", price=1, category="other", stock=options["stock"]
+        )
+
+        errors = []
+        oversold = []
+        counts = {"ok": 0, "out_of_stock": 0, "rejected": 0}
+        lock = threading.Lock()
+
+        def worker(buyer, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(options["operations"]):
+                    operation = rng.choice(["add", "add", "increase", "decrease", "remove"])
+                    try:
+                        if operation == "add":
+                            inventory.add_to_cart(buyer, product, rng.randint(1, 3))
+                        elif operation == "increase":
+                            inventory.change_quantity(buyer, product, 1)
+                        elif operation == "decrease":
+                            inventory.change_quantity(buyer, product, -1)
+                        else:
+                            inventory.remove_from_cart(buyer, product)
+                        result = "ok"
+                    except inventory.OutOfStock:
+                        result = "out_of_stock"
+                    except (CartItem.DoesNotExist, ValueError):
+                        result = "rejected"
+                    held = inventory.held_quantities([product.pk]).get(product.pk, 0)
+                    with lock:
+                        counts[result] += 1
+                        if held > options["stock"]:
+                            oversold.append(held)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(buyer, i)) for i, buyer in enumerate(buyers)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            close_old_connections()
+
+            product.refresh_from_db(fields=["stock"])
+            held = inventory.held_quantities([product.pk]).get(product.pk, 0)
+            self.stdout.write(
+                f"{counts['ok']} ok, {counts['out_of_stock']} out of stock, {counts['rejected']} rejected; "
+                f"on hand {product.stock} (started with {options['stock']}), held {held}"
+            )
+        finally:
+            Cart.objects.filter(user__in=buyers).delete()
+            product.delete()
+            User.objects.filter(pk__in=[seller.pk] + [buyer.pk for buyer in buyers]).delete()
+
+        if errors:
+            raise CommandError(f"{len(errors)} worker(s) failed, first error: {errors[0]}")
+        if oversold:
+            raise CommandError(f"Holds exceeded the stock: {max(oversold)} held of {options['stock']}")
+        if product.stock != options["stock"]:
+            raise CommandError(f"Stock drifted: {product.stock} on hand != {options['stock']}")
+        self.stdout.write(self.style.SUCCESS("Stock stayed consistent"))
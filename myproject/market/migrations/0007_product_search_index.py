@@ -0,0 +1,86 @@
+from django.db import migrations
+
+# The DDL is copied here rather than imported from market.search, so this migration keeps
+# creating the same index whatever the live module becomes.
+#
+# Postgres: the spanish_unaccent config strips accents with the unaccent extension. Creating
+# an extension needs a superuser (or a trusted extension), so when the role can't, run
+# `CREATE EXTENSION unaccent` as a superuser before migrating; otherwise the config is created
+# without unaccent and searches are accent-sensitive until the index is recreated.
+
+PG_CREATE = [
+    """
+    DO $$ BEGIN
+        CREATE EXTENSION IF NOT EXISTS unaccent;
+    EXCEPTION WHEN insufficient_privilege OR undefined_file THEN
+        RAISE WARNING 'unaccent extension unavailable, spanish_unaccent will not strip accents';
+    END $$
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'spanish_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION spanish_unaccent (COPY = spanish);
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'unaccent') THEN
+                ALTER TEXT SEARCH CONFIGURATION spanish_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+            END IF;
+        END IF;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS market_product_search (
+        product_id bigint PRIMARY KEY REFERENCES market_product(id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS market_product_search_document_gin ON market_product_search USING gin(document)",
+    # Title weighs the most, then brand, then description
+    """
+    INSERT INTO market_product_search (product_id, document)
+    SELECT id,
+        setweight(to_tsvector('spanish_unaccent', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('spanish_unaccent', coalesce(description, '')), 'C') ||
+        setweight(to_tsvector('spanish_unaccent', coalesce(brand, '')), 'B')
+    FROM market_product
+    ON CONFLICT (product_id) DO NOTHING
+    """,
+]
+PG_DROP = [
+    "DROP TABLE IF EXISTS market_product_search",
+    "DROP TEXT SEARCH CONFIGURATION IF EXISTS spanish_unaccent",
+]
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS market_product_fts
+    USING fts5(title, description, brand, tokenize = 'unicode61 remove_diacritics 2')
+    """,
+    """
+    INSERT INTO market_product_fts (rowid, title, description, brand)
+    SELECT id, coalesce(title, ''), coalesce(description, ''), coalesce(brand, '') FROM market_product
+    """,
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS market_product_fts"]
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {'postgresql': PG_CREATE, 'sqlite': SQLITE_CREATE}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {'postgresql': PG_DROP, 'sqlite': SQLITE_DROP}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_product_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
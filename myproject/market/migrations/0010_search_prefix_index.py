@@ -0,0 +1,30 @@
+from django.db import migrations
+
+# DDL copied here rather than imported from market.search, see 0007_product_search_index
+
+
+def recreate_sqlite_index(apps, schema_editor):
+    # FTS5 options can't be altered, the dev index is rebuilt with prefix indexes
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS market_product_fts")
+    # prefix= keeps prefix indexes for 2-4 chars, used by search-as-you-type
+    schema_editor.execute("""
+        CREATE VIRTUAL TABLE market_product_fts
+        USING fts5(title, description, brand, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')
+    """)
+    schema_editor.execute("""
+        INSERT INTO market_product_fts (rowid, title, description, brand)
+        SELECT id, coalesce(title, ''), coalesce(description, ''), coalesce(brand, '') FROM market_product
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(recreate_sqlite_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:19
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+
+def _carted_units(apps):
+    CartItem = apps.get_model('market', 'CartItem')
+    return Coalesce(Subquery(
+        CartItem.objects.filter(product_id=OuterRef('pk'))
+        .order_by().values('product_id').annotate(total=Sum('quantity')).values('total')
+    ), 0)
+
+
+def _carted_products(apps):
+    Product = apps.get_model('market', 'Product')
+    CartItem = apps.get_model('market', 'CartItem')
+    return Product.objects.filter(pk__in=CartItem.objects.values('product_id'))
+
+
+def return_carted_stock(apps, schema_editor):
+    # Carted units used to be taken out of stock on add to cart, now they are only held
+    _carted_products(apps).update(stock=F('stock') + _carted_units(apps))
+
+
+def take_carted_stock(apps, schema_editor):
+    _carted_products(apps).update(stock=Greatest(F('stock') - _carted_units(apps), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_search_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='held_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(return_carted_stock, take_carted_stock),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('held_until__isnull', False)), fields=['product', 'held_until'], name='cartitem_hold_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_orders_paid(apps, schema_editor):
+    # Orders used to be created only once their payment was finalized
+    Order = apps.get_model('market', 'Order')
+    Order.objects.update(status='paid', paid_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_orders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_history_idx',
+        ),
+        migrations.RemoveField(
+            model_name='paymentnotification',
+            name='cart',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Esperando el pago'), ('paid', 'Pagado'), ('flagged', 'Pago a revisar')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='paymentnotification',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='market.order'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='payment_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='paymentnotification',
+            name='result',
+            field=models.CharField(blank=True, choices=[('approved', 'Aprobado'), ('shortage', 'Aprobado sin stock suficiente'), ('rejected', 'Rechazado'), ('failed', 'No se pudo verificar'), ('flagged', 'Aprobado, a revisar')], max_length=20),
+        ),
+        migrations.RunPython(mark_orders_paid, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'paid')), fields=['user', '-created_at', '-id'], name='order_history_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# Postgres only: prefix suggestions match whole typed words against an unstemmed copy of the
+# title and brand. The Spanish document stems "zapatos" to "zapat", so a typed "zapatos"
+# can't match it as a prefix, and stemming a partial token changes what it matches.
+# simple_unaccent falls back to plain simple when unaccent isn't installed (see 0007).
+
+PG_CREATE = [
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'simple_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION simple_unaccent (COPY = simple);
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'unaccent') THEN
+                ALTER TEXT SEARCH CONFIGURATION simple_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple;
+            END IF;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE market_product_search ADD COLUMN IF NOT EXISTS words tsvector NOT NULL DEFAULT ''",
+    """
+    UPDATE market_product_search SET words =
+        setweight(to_tsvector('simple_unaccent', coalesce(market_product.title, '')), 'A') ||
+        setweight(to_tsvector('simple_unaccent', coalesce(market_product.brand, '')), 'B')
+    FROM market_product
+    WHERE market_product.id = market_product_search.product_id
+    """,
+    "CREATE INDEX IF NOT EXISTS market_product_search_words_gin ON market_product_search USING gin(words)",
+]
+PG_DROP = [
+    "DROP INDEX IF EXISTS market_product_search_words_gin",
+    "ALTER TABLE market_product_search DROP COLUMN IF EXISTS words",
+    "DROP TEXT SEARCH CONFIGURATION IF EXISTS simple_unaccent",
+]
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in PG_CREATE:
+            schema_editor.execute(sql)
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in PG_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_order_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
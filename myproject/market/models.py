@@ -1,5 +1,8 @@
+from decimal import Decimal
 from django.conf import settings
 from django.db import models
+from django.db.models import Count, F, Sum, Window
+from django.utils import timezone
 
 class Product(models.Model):
     CATEGORY_CHOICES = [
@@ -24,9 +27,22 @@ class Product(models.Model):
     image = models.ImageField(upload_to="product_images/", blank=True, null=True)  # Optional
     active = models.BooleanField(default=True)
     favorited_by = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='favorites', blank=True)
+    favorites_count = models.PositiveIntegerField(default=0)  # Denormalized len(favorited_by), for sorting
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)  #Last Modified
 
+    class Meta:
+        # Shaped after the listing queries: active products, newest first, paginated on (created_at, id)
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], condition=models.Q(active=True), name="product_active_recent_idx"),
+            models.Index(fields=["category", "-created_at", "-id"], condition=models.Q(active=True), name="product_active_cat_idx"),
+            models.Index(fields=["seller", "-created_at", "-id"], condition=models.Q(active=True), name="product_seller_recent_idx"),
+            # Sort modes, each index is also walked backwards for the opposite direction
+            models.Index(fields=["price", "id"], condition=models.Q(active=True), name="product_active_price_idx"),
+            models.Index(fields=["-favorites_count", "-id"], condition=models.Q(active=True), name="product_active_popular_idx"),
+            models.Index(fields=["-stock", "-id"], condition=models.Q(active=True), name="product_active_stock_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -34,16 +50,177 @@ class Product(models.Model):
         return self.active and self.stock > 0
 
 
+CENTS = Decimal("0.01")
+
+# price * quantity of a cart item row
+LINE_SUBTOTAL = models.ExpressionWrapper(
+    F("product__price") * F("quantity"), output_field=models.DecimalField(max_digits=12, decimal_places=2)
+)
+
+
+class CartSummary:
+    """Cart items with their products, line subtotals and totals, loaded in a single query"""
+
+    def __init__(self, items, total=None):
+        # SQLite drops the decimal places of computed values, keep amounts in cents everywhere
+        for item in items:
+            item.line_subtotal = item.line_subtotal.quantize(CENTS)
+        if total is None:
+            total = items[0].cart_total if items else Decimal("0")
+        self.items = items
+        self.total = total.quantize(CENTS)
+        self.quantity = sum(item.quantity for item in items)
+
+    def totals(self):
+        """Same shape as Cart.totals()"""
+        return {"total": self.total, "lines": len(self.items), "quantity": self.quantity}
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    def summary(self):
+        return CartSummary(list(CartItem.objects.filter(cart=self).with_subtotals()))
+
     def total(self):
-        return sum(item.subtotal() for item in self.items.all())
-    
+        return CartItem.objects.filter(cart=self).aggregate(
+            total=Sum(LINE_SUBTOTAL, default=Decimal("0"))
+        )["total"].quantize(CENTS)
+
+    def totals(self):
+        """Total amount, number of lines and number of units of the cart, in one aggregate query"""
+        totals = CartItem.objects.filter(cart=self).aggregate(
+            total=Sum(LINE_SUBTOTAL, default=Decimal("0")),
+            lines=Count("id"),
+            quantity=Sum("quantity", default=0),
+        )
+        totals["total"] = totals["total"].quantize(CENTS)
+        return totals
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        """Join the product and compute every line subtotal plus the cart total (window sum) in SQL"""
+        return self.select_related("product").annotate(
+            line_subtotal=LINE_SUBTOTAL,
+            cart_total=Window(Sum(LINE_SUBTOTAL), partition_by=[F("cart_id")]),
+        ).order_by("id")
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # The item's units are reserved for this cart until then (see market.inventory)
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="cartitem_unique_product"),
+        ]
+        indexes = [
+            # Live holds of a product are summed on every add to cart
+            models.Index(fields=["product", "held_until"], condition=models.Q(held_until__isnull=False), name="cartitem_hold_idx"),
+        ]
+
+    def is_held(self):
+        return self.held_until is not None and self.held_until > timezone.now()
 
     def subtotal(self):
-        return self.product.price * self.quantity
\ No newline at end of file
+        # Rows from with_subtotals() already carry it
+        if hasattr(self, "line_subtotal"):
+            return self.line_subtotal
+        return self.product.price * self.quantity
+
+
+class Order(models.Model):
+    """
+    A checkout frozen when the buyer is sent to pay: titles, prices and totals don't follow
+    later cart or product edits, so what is finalized, printed on receipts and listed in the
+    purchase history is exactly what was paid for. Created pending by market.orders, paid
+    (or flagged) by market.payments once Mercado Pago reports the payment
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Esperando el pago'),
+        ('paid', 'Pagado'),
+        ('flagged', 'Pago a revisar'),
+    ]
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="orders")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Set once a payment for this order is finalized
+    payment_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    # Buyer as printed on the receipt
+    buyer_username = models.CharField(max_length=150)
+    buyer_email = models.EmailField(blank=True)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    quantity = models.PositiveIntegerField()  # Units bought
+    line_count = models.PositiveIntegerField()
+    summary = models.CharField(max_length=255)  # Listed in the purchase history
+
+    class Meta:
+        indexes = [
+            # Purchase history: WHERE user_id = ... AND status = 'paid' ORDER BY created_at DESC, id DESC
+            models.Index(fields=["user", "-created_at", "-id"], condition=models.Q(status="paid"), name="order_history_idx"),
+        ]
+
+    def __str__(self):
+        return f"Order {self.pk} ({self.buyer_username})"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    title = models.CharField(max_length=200)
+    brand = models.CharField(max_length=100, blank=True)
+    unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.title}"
+
+
+class PaymentNotification(models.Model):
+    """
+    Durable queue of Mercado Pago payments to finalize, one row per payment id.
+    Filled by the webhook and the checkout return URL, drained by `manage.py process_payments`
+    """
+    RESULT_CHOICES = [
+        ('approved', 'Aprobado'),
+        ('shortage', 'Aprobado sin stock suficiente'),
+        ('rejected', 'Rechazado'),
+        ('failed', 'No se pudo verificar'),
+        ('flagged', 'Aprobado, a revisar'),
+    ]
+    payment_id = models.CharField(max_length=64, unique=True)
+    # The order in the payment's external_reference
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    received_at = models.DateTimeField(auto_now_add=True)
+    # Pending payments and failed lookups are tried again from then on
+    retry_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    result = models.CharField(max_length=20, choices=RESULT_CHOICES, blank=True)
+    detail = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker only ever scans the pending rows
+            models.Index(fields=["retry_at"], condition=models.Q(processed_at__isnull=True), name="payment_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"Payment {self.payment_id} ({self.result or 'pending'})"
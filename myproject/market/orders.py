@@ -0,0 +1,73 @@
+from django.db import transaction
+from .models import Order, OrderLine
+from .pagination import KeysetPaginator
+
+HISTORY_PAGE_SIZE = 10
+
+
+def _summary(items):
+    titles = [item.product.title for item in items]
+    if len(titles) == 1:
+        return titles[0][:255]
+    more = f" y {len(titles) - 1} producto{'s' if len(titles) > 2 else ''} más"
+    return titles[0][:255 - len(more)] + more
+
+
+@transaction.atomic
+def create_pending_order(user, summary):
+    """
+    Freeze the cart as it is sent to pay: a pending order with the current titles, prices
+    and totals, written with two INSERTs. Finalizing the payment later only reads this
+    snapshot, never the live cart or products
+
+    Args:
+        summary: The CartSummary the buyer is charged for
+    """
+    items = list(summary)
+    order = Order.objects.create(
+        user=user,
+        buyer_username=user.username,
+        buyer_email=user.email,
+        total=summary.total,
+        quantity=summary.quantity,
+        line_count=len(items),
+        summary=_summary(items),
+    )
+    OrderLine.objects.bulk_create([
+        OrderLine(
+            order=order,
+            product=item.product,
+            title=item.product.title,
+            brand=item.product.brand,
+            unit_price=item.product.price,
+            quantity=item.quantity,
+            subtotal=item.line_subtotal,
+        )
+        for item in items
+    ])
+    return order
+
+
+def order_history_paginator(user):
+    """Keyset paginator over the user's paid orders, newest first (served by order_history_idx)"""
+    return KeysetPaginator(
+        Order.objects.filter(user=user, status="paid"),
+        ordering=("-created_at", "-id"),
+        per_page=HISTORY_PAGE_SIZE,
+    )
+
+
+def order_with_lines(user, pk):
+    """
+    The user's paid order with its lines, read with a single query
+
+    Raises:
+        Order.DoesNotExist: No such paid order for this user
+    """
+    lines = list(OrderLine.objects.filter(order_id=pk, order__user=user, order__status="paid").select_related("order").order_by("id"))
+    if not lines:
+        raise Order.DoesNotExist(f"No order {pk} for this user")
+    order = lines[0].order
+    for line in lines:
+        line.order = order
+    return order, lines
@@ -0,0 +1,223 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from .search import search_products
+from .utils import in_stock_q
+
+LISTING_PAGE_SIZE = 12
+
+# Sort modes of the listings, each one backed by a partial index on active products
+SORT_CHOICES = [
+    ('newest', 'Más recientes'),
+    ('price_asc', 'Menor precio'),
+    ('price_desc', 'Mayor precio'),
+    ('popular', 'Más populares'),
+    ('stock', 'Mayor stock'),
+]
+SORT_ORDERINGS = {
+    'newest': ("-created_at", "-id"),
+    'price_asc': ("price", "id"),
+    'price_desc': ("-price", "-id"),
+    'popular': ("-favorites_count", "-id"),
+    'stock': ("-stock", "-id"),
+}
+CURSOR_SALT = "market.pagination.cursor"
+APPROXIMATE_COUNT_LIMIT = 1000
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor token was tampered with or doesn't match the ordering"""
+    pass
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    """One page of a keyset paginated queryset, with the same helpers templates expect from Page"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor,
+                 count=None, count_is_exact=False):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_exact = count_is_exact
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Cursor based paginator: every page is a `WHERE (key) < (last key) ORDER BY key LIMIT n`
+    query, so deep pages cost the same as the first one and there is no COUNT(*)
+
+    Args:
+        queryset: Filtered queryset to paginate
+        ordering: Field names (prefixed with "-" for descending) that uniquely order the rows,
+                  the last one should be the primary key
+        per_page: Page size
+        filters: Extra dict stored inside the cursor (e.g. search/category) so the token is
+                 self-contained
+    """
+
+    def __init__(self, queryset, ordering=("-created_at", "-id"), per_page=12, filters=None):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.filters = filters or {}
+
+    def _fields(self):
+        return [field.lstrip("-") for field in self.ordering]
+
+    def make_cursor(self, obj, direction):
+        values = [_encode(getattr(obj, field)) for field in self._fields()]
+        return signing.dumps(
+            {"o": self.ordering, "k": values, "d": direction, "f": self.filters},
+            salt=CURSOR_SALT,
+            compress=True,
+        )
+
+    @staticmethod
+    def read_cursor(token):
+        """Return the decoded cursor payload or raise InvalidCursor"""
+        try:
+            return signing.loads(token, salt=CURSOR_SALT)
+        except (signing.BadSignature, json.JSONDecodeError, TypeError) as e:
+            raise InvalidCursor(str(e))
+
+    def _seek(self, values, reverse):
+        """Build the lexicographic (a, b, c) > (x, y, z) condition for the ordering"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            descending = field.startswith("-") != reverse
+            condition |= Q(**equal, **{f"{name}__{'lt' if descending else 'gt'}": value})
+            equal[name] = value
+
+        # Redundant bound on the leading column so the database can seek into the index
+        name = self.ordering[0].lstrip("-")
+        descending = self.ordering[0].startswith("-") != reverse
+        return Q(**{f"{name}__{'lte' if descending else 'gte'}": values[0]}) & condition
+
+    def page_queryset(self, token=None):
+        """
+        Return (queryset, direction) for the page after/before the cursor,
+        sliced to one row more than a page to detect if there are more rows
+        """
+        direction = "next"
+        queryset = self.queryset
+        ordering = self.ordering
+
+        if token:
+            payload = self.read_cursor(token)
+            if payload.get("o") != self.ordering or len(payload.get("k", [])) != len(self.ordering):
+                raise InvalidCursor("Cursor does not match the current ordering")
+            direction = payload.get("d", "next")
+            reverse = direction == "previous"
+            queryset = queryset.filter(self._seek(payload["k"], reverse))
+            if reverse:
+                ordering = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+
+        return queryset.order_by(*ordering)[:self.per_page + 1], direction
+
+    def get_page(self, token=None, with_count=False):
+        queryset, direction = self.page_queryset(token)
+        rows = list(queryset)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == "previous":
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(token)
+
+        count, count_is_exact = (
+            approximate_count(self.queryset.order_by(*self.ordering)) if with_count else (None, False)
+        )
+
+        return KeysetPage(
+            rows,
+            has_next=has_next,
+            has_previous=has_previous,
+            next_cursor=self.make_cursor(rows[-1], "next") if rows and has_next else None,
+            previous_cursor=self.make_cursor(rows[0], "previous") if rows and has_previous else None,
+            count=count,
+            count_is_exact=count_is_exact,
+        )
+
+
+def product_listing_paginator(products, category="", search="", sort="", in_stock=False):
+    """
+    Paginator for the market listings, filtered and ordered the way the views show them
+
+    Searches are ranked by relevance unless a sort mode is picked explicitly
+    """
+    if category:
+        products = products.filter(category=category)
+
+    if in_stock:
+        products = products.filter(in_stock_q())
+
+    if search:
+        products = search_products(products, search)
+
+    if sort in SORT_ORDERINGS:
+        ordering = SORT_ORDERINGS[sort]
+    elif search:
+        ordering = ("-search_rank", "-created_at", "-id")
+    else:
+        ordering = SORT_ORDERINGS['newest']
+
+    return KeysetPaginator(
+        products,
+        ordering=ordering,
+        per_page=LISTING_PAGE_SIZE,
+        filters={"category": category, "search": search, "sort": sort, "in_stock": in_stock},
+    )
+
+
+def approximate_count(queryset, limit=APPROXIMATE_COUNT_LIMIT):
+    """
+    Cheap row count estimate
+
+    Postgres reads the planner estimate from EXPLAIN, other backends count
+    at most `limit` + 1 rows (keep the queryset ordered so the bounded
+    count walks the listing index). Returns (count, is_exact).
+    """
+    if connection.vendor == "postgresql":
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), False
+
+    count = queryset[:limit + 1].count()
+    return min(count, limit), count <= limit
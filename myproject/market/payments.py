@@ -0,0 +1,294 @@
+import hashlib
+import hmac
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import mercadopago
+import requests
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import CENTS, Order, PaymentNotification
+from .inventory import commit_orders
+from .orders import create_pending_order
+
+MERCADOPAGO_API_URL = "https://api.mercadopago.com"
+PREFERENCE_PREFIX = "mercadopago:preference"
+
+# Payment statuses that can still turn into approved, their notification is tried again later
+PENDING_STATUSES = {"pending", "in_process", "authorized"}
+# Lookups of a payment before giving up on it
+MAX_ATTEMPTS = 8
+# Digits of a payment id taken from a request, ids are 64-bit integers
+MAX_PAYMENT_ID_LENGTH = 20
+
+
+class PaymentError(Exception):
+    """Raised when Mercado Pago rejects a request"""
+    pass
+
+
+class PooledHttpClient(HttpClient):
+    """
+    HttpClient for the Mercado Pago SDK that keeps one keep-alive session per thread,
+    instead of opening a new session and TLS connection on every call
+
+    Args:
+        base_url: Replaces the Mercado Pago API URL, e.g. to point at fake_mercadopago
+        pool_size: Connections kept open per session
+    """
+
+    def __init__(self, base_url=MERCADOPAGO_API_URL, pool_size=10, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_size,
+                max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        if url.startswith(MERCADOPAGO_API_URL):
+            url = self.base_url + url[len(MERCADOPAGO_API_URL):]
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        api_result = self._session().request(method, url, **kwargs)
+        response = {"status": api_result.status_code, "response": None}
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response["response"] = api_result.json()
+            except ValueError:
+                pass
+        return response
+
+
+@lru_cache(maxsize=1)
+def get_sdk():
+    """Process wide SDK, built once from the settings"""
+    return mercadopago.SDK(
+        settings.MERCADOPAGO_ACCESS_TOKEN,
+        http_client=PooledHttpClient(settings.MERCADOPAGO_API_URL),
+    )
+
+
+def _preference_key(cart, preference_data):
+    payload = json.dumps(preference_data, sort_keys=True, default=str)
+    return f"{PREFERENCE_PREFIX}:{cart.pk}:{hashlib.sha1(payload.encode()).hexdigest()}"
+
+
+def checkout_preference(cart, summary, back_urls):
+    """
+    init_point of a Mercado Pago preference for the cart contents
+
+    The contents are frozen as a pending Order whose id goes in external_reference, so
+    the payment finalizes exactly what the buyer was charged for. Preferences are cached
+    by a hash of the items, prices and return URLs: paying the same cart again reuses the
+    preference and its order without calling Mercado Pago, as long as that order is unpaid
+
+    Returns:
+        (init_point, created)
+    """
+    preference_data = {
+        "items": [{
+            "id": str(item.product_id),
+            "title": item.product.title,
+            "quantity": item.quantity,
+            "unit_price": float(item.product.price),
+            "currency_id": "ARS",
+        } for item in summary],
+        "back_urls": back_urls,
+        "auto_return": "approved",
+    }
+    key = _preference_key(cart, preference_data)
+    cached = cache.get(key)
+    if cached is not None:
+        init_point, order_id = cached
+        if Order.objects.filter(pk=order_id, status="pending").exists():
+            return init_point, False
+
+    order = create_pending_order(cart.user, summary)
+    preference = get_sdk().preference().create({**preference_data, "external_reference": str(order.pk)})
+    if preference["status"] not in (200, 201):
+        raise PaymentError(f"Mercado Pago answered {preference['status']}: {preference['response']}")
+    init_point = preference["response"]["init_point"]
+    cache.set(key, (init_point, order.pk), settings.MERCADOPAGO_PREFERENCE_CACHE_TIMEOUT)
+    return init_point, True
+
+
+def verify_webhook_signature(signature, request_id, data_id):
+    """
+    Check the x-signature header of a Mercado Pago webhook ("ts=...,v1=...") against
+    MERCADOPAGO_WEBHOOK_SECRET, in constant time
+    """
+    secret = settings.MERCADOPAGO_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    parts = dict(part.strip().split("=", 1) for part in signature.split(",") if "=" in part)
+    if "ts" not in parts or "v1" not in parts:
+        return False
+
+    manifest = ""
+    if data_id:
+        manifest += f"id:{data_id.lower()};"
+    if request_id:
+        manifest += f"request-id:{request_id};"
+    manifest += f"ts:{parts['ts']};"
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, parts["v1"])
+
+
+def is_payment_id(value):
+    """Whether value looks like a Mercado Pago payment id: ASCII digits, short enough for the queue"""
+    return value.isascii() and value.isdigit() and len(value) <= MAX_PAYMENT_ID_LENGTH
+
+
+def _is_order_id(reference):
+    # Fits a bigint primary key
+    return reference.isascii() and reference.isdigit() and len(reference) <= 18
+
+
+def enqueue_payment(payment_id):
+    """Queue a payment to be finalized, a single INSERT that does nothing if it's already queued"""
+    PaymentNotification.objects.bulk_create(
+        [PaymentNotification(payment_id=str(payment_id))], ignore_conflicts=True
+    )
+
+
+def _fetch_payment(payment_id):
+    """(payment, error) as read back from Mercado Pago"""
+    try:
+        payment = get_sdk().payment().get(payment_id)
+    except requests.RequestException as e:
+        return None, repr(e)
+    if payment["status"] != 200 or not payment["response"]:
+        return None, f"Mercado Pago answered {payment['status']}: {payment['response']}"
+    return payment["response"], ""
+
+
+def _retry(notification, error):
+    notification.attempts += 1
+    notification.detail = error
+    if notification.attempts >= MAX_ATTEMPTS:
+        notification.result = "failed"
+        notification.processed_at = timezone.now()
+    else:
+        notification.retry_at = timezone.now() + timedelta(seconds=30 * 2 ** notification.attempts)
+
+
+def finalize_payments(batch_size=100, payment_ids=None, fetch_workers=8):
+    """
+    Finalize a batch of queued payments
+
+    Every payment is read back from Mercado Pago (concurrently), then the orders of the
+    approved ones are committed together with one bulk stock update. A payment whose
+    amount differs from its order total, or whose order is already paid, is flagged and
+    takes no stock. A payment is only ever finalized once: duplicated notifications and
+    concurrent workers skip the rows that are already processed or being processed
+
+    Args:
+        payment_ids: Only finalize these payments (e.g. the one the buyer is returning with)
+
+    Returns:
+        The processed or rescheduled notifications
+    """
+    pending = PaymentNotification.objects.filter(processed_at__isnull=True, retry_at__lte=timezone.now())
+    if payment_ids is not None:
+        pending = pending.filter(payment_id__in=[str(pk) for pk in payment_ids])
+    ids = list(pending.order_by("retry_at").values_list("payment_id", flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # Outside of the transaction: nothing is locked while waiting on the API
+    with ThreadPoolExecutor(max_workers=min(fetch_workers, len(ids))) as executor:
+        fetched = dict(zip(ids, executor.map(_fetch_payment, ids)))
+
+    with transaction.atomic():
+        notifications = list(
+            PaymentNotification.objects.select_for_update(skip_locked=True)
+            .filter(payment_id__in=ids, processed_at__isnull=True)
+        )
+        approved, references = [], {}
+        for notification in notifications:
+            payment, error = fetched[notification.payment_id]
+            if payment is None:
+                _retry(notification, error)
+                continue
+            status = payment.get("status")
+            if status in PENDING_STATUSES:
+                _retry(notification, f"Payment {status}")
+                continue
+
+            notification.processed_at = timezone.now()
+            notification.result = "approved" if status == "approved" else "rejected"
+            reference = str(payment.get("external_reference") or "")
+            references[notification] = int(reference) if _is_order_id(reference) else None
+            if notification.result == "approved":
+                approved.append((notification, payment))
+
+        # Unknown references are dropped, a dangling foreign key would fail the whole batch at commit
+        existing = set(
+            Order.objects.filter(pk__in={pk for pk in references.values() if pk is not None})
+            .values_list("pk", flat=True)
+        )
+        for notification, order_id in references.items():
+            notification.order_id = order_id if order_id in existing else None
+
+        orders = {
+            order.pk: order
+            for order in Order.objects.select_for_update().filter(
+                pk__in={notification.order_id for notification, payment in approved}, status="pending"
+            ).order_by("pk")
+        }
+        paid, checked = [], []
+        for notification, payment in approved:
+            # A second payment of the same order finds it already taken
+            order = orders.pop(notification.order_id, None)
+            if order is None:
+                notification.result = "flagged"
+                notification.detail = "Order not found or already paid"
+                continue
+            try:
+                amount = Decimal(str(payment.get("transaction_amount"))).quantize(CENTS)
+            except InvalidOperation:
+                amount = None
+            order.payment_id = notification.payment_id
+            checked.append(order)
+            if amount != order.total:
+                order.status = notification.result = "flagged"
+                notification.detail = f"Paid {amount}, order total {order.total}"
+                continue
+            order.status = "paid"
+            order.paid_at = notification.processed_at
+            paid.append((notification, order))
+
+        committed = commit_orders([order for notification, order in paid]) if paid else {}
+        for notification, order in paid:
+            fulfilled, shortages = committed[order.pk]
+            if shortages:
+                notification.result = "shortage"
+                notification.detail = ", ".join(line.title for line in shortages)
+        Order.objects.bulk_update(checked, ["status", "payment_id", "paid_at"])
+
+        PaymentNotification.objects.bulk_update(
+            notifications, ["order", "retry_at", "attempts", "processed_at", "result", "detail"]
+        )
+    return notifications
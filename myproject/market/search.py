@@ -0,0 +1,241 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+
+# Full-text index kept next to market_product, maintained by market.signals
+# Postgres: tsvector + GIN index with a Spanish, accent-insensitive config
+# SQLite (dev): FTS5 virtual table with diacritics removed
+# The tables are created by migrations 0007, 0010 and 0016 (unaccent must be installable, see 0007)
+PG_TABLE = "market_product_search"
+PG_CONFIG = "spanish_unaccent"
+# Unstemmed title and brand words of the Postgres documents, for prefix suggestions
+PG_PREFIX_CONFIG = "simple_unaccent"
+SQLITE_TABLE = "market_product_fts"
+
+INDEXED_FIELDS = ("title", "description", "brand")
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+SUGGEST_MIN_LENGTH = 2
+# Most favorited products read from the index per prefix, their titles and brands are suggested
+SUGGEST_CANDIDATES = 200
+
+
+def _sqlite_match(query):
+    """Turn free text into an FTS5 prefix query: 'zapato rojo' -> '"zapato"* "rojo"*'"""
+    return " ".join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def index_products(rows):
+    """
+    Insert or replace search documents
+
+    Args:
+        rows: Iterable of (id, title, description, brand) tuples
+    """
+    rows = [(pk, title or "", description or "", brand or "") for pk, title, description, brand in rows]
+    if not rows:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # Title weighs the most, then brand, then description
+            cursor.executemany(f"""
+                INSERT INTO {PG_TABLE} (product_id, document, words)
+                VALUES (%s,
+                    setweight(to_tsvector('{PG_CONFIG}', %s), 'A') ||
+                    setweight(to_tsvector('{PG_CONFIG}', %s), 'C') ||
+                    setweight(to_tsvector('{PG_CONFIG}', %s), 'B'),
+                    setweight(to_tsvector('{PG_PREFIX_CONFIG}', %s), 'A') ||
+                    setweight(to_tsvector('{PG_PREFIX_CONFIG}', %s), 'B'))
+                ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document, words = EXCLUDED.words
+            """, [(pk, title, description, brand, title, brand) for pk, title, description, brand in rows])
+        elif connection.vendor == "sqlite":
+            cursor.executemany(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, title, description, brand) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+
+def unindex_products(ids):
+    """Remove the search documents of the given product ids"""
+    ids = [(pk,) for pk in ids]
+    if not ids:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.executemany(f"DELETE FROM {PG_TABLE} WHERE product_id = %s", ids)
+        elif connection.vendor == "sqlite":
+            cursor.executemany(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s", ids)
+
+
+def rebuild_index(queryset, batch_size=2000):
+    """Reindex every product in queryset in batches. Returns the number of indexed products"""
+    total = 0
+    batch = []
+    for row in queryset.values_list("id", *INDEXED_FIELDS).iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            index_products(batch)
+            total += len(batch)
+            batch = []
+    index_products(batch)
+    return total + len(batch)
+
+
+def search_products(queryset, query):
+    """
+    Filter queryset to the products matching query using the full-text index
+
+    Results are annotated with `search_rank` (higher is more relevant).
+    Backends without an index fall back to icontains matching.
+    """
+    query = (query or "").strip()
+    rank_field = FloatField()
+
+    if connection.vendor == "postgresql":
+        tsquery = f"websearch_to_tsquery('{PG_CONFIG}', %s)"
+        matches = RawSQL(f"SELECT product_id FROM {PG_TABLE} WHERE document @@ {tsquery}", [query])
+        rank = RawSQL(
+            f"SELECT ts_rank(document, {tsquery}) FROM {PG_TABLE} "
+            f"WHERE product_id = market_product.id",
+            [query],
+            output_field=rank_field,
+        )
+    elif connection.vendor == "sqlite":
+        match = _sqlite_match(query)
+        if not match:
+            return queryset.none()
+        matches = RawSQL(f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s", [match])
+        # bm25() is lower-is-better, flip it so every backend sorts descending
+        rank = RawSQL(
+            f"SELECT -bm25({SQLITE_TABLE}, 10.0, 1.0, 5.0) FROM {SQLITE_TABLE} "
+            f"WHERE {SQLITE_TABLE} MATCH %s AND rowid = market_product.id",
+            [match],
+            output_field=rank_field,
+        )
+    else:
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(brand__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=rank_field))
+
+    return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+class HotPrefixCache:
+    """Small per-process LRU with expiry for the most requested suggestion prefixes"""
+
+    def __init__(self, maxsize=1024, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+suggestion_cache = HotPrefixCache(timeout=settings.SUGGEST_CACHE_TIMEOUT)
+
+
+def normalize_prefix(prefix):
+    """Lowercase, accent-free, single spaced version of prefix (what the index sees)"""
+    text = unicodedata.normalize("NFKD", prefix.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(TOKEN_RE.findall(text))
+
+
+def _prefix_matches(prefix, column):
+    """
+    Subquery with the ids of the SUGGEST_CANDIDATES most favorited products whose column
+    starts words with prefix. Popularity is ordered before the LIMIT so the popular matches
+    are the ones kept
+    """
+    tokens = TOKEN_RE.findall(prefix)
+    if connection.vendor == "postgresql":
+        weight = {"title": "A", "brand": "B"}[column]
+        tsquery = " & ".join(f"{token}:*{weight}" for token in tokens)
+        return RawSQL(
+            f"SELECT s.product_id FROM {PG_TABLE} s JOIN market_product p ON p.id = s.product_id "
+            f"WHERE s.words @@ to_tsquery('{PG_PREFIX_CONFIG}', %s) "
+            f"ORDER BY p.favorites_count DESC, p.id DESC LIMIT %s",
+            [tsquery, SUGGEST_CANDIDATES],
+        )
+    if connection.vendor == "sqlite":
+        match = f"{column} : ({_sqlite_match(prefix)})"
+        return RawSQL(
+            f"SELECT f.rowid FROM {SQLITE_TABLE} f JOIN market_product p ON p.id = f.rowid "
+            f"WHERE {SQLITE_TABLE} MATCH %s ORDER BY p.favorites_count DESC, p.id DESC LIMIT %s",
+            [match, SUGGEST_CANDIDATES],
+        )
+    return None
+
+
+def suggest(products, prefix, limit=8):
+    """
+    Title and brand completions for prefix, most favorited titles and most used brands first
+
+    Results are kept in a per-process hot-prefix cache
+
+    Returns:
+        {"titles": [...], "brands": [...]}
+    """
+    key = normalize_prefix(prefix)
+    if len(key) < SUGGEST_MIN_LENGTH:
+        return {"titles": [], "brands": []}
+
+    cached = suggestion_cache.get((key, limit))
+    if cached is not None:
+        return cached
+
+    title_ids = _prefix_matches(key, "title")
+    brand_ids = _prefix_matches(key, "brand")
+    if title_ids is None:
+        titles = products.filter(title__icontains=key)
+        brands = products.filter(brand__icontains=key)
+    else:
+        titles = products.filter(id__in=title_ids)
+        brands = products.filter(id__in=brand_ids)
+
+    result = {
+        "titles": list(dict.fromkeys(
+            titles.order_by("-favorites_count", "-id").values_list("title", flat=True)[:limit * 2]
+        ))[:limit],
+        "brands": list(
+            brands.exclude(brand="").order_by().values("brand")
+            .annotate(total=Count("id")).order_by("-total")
+            .values_list("brand", flat=True)[:limit]
+        ),
+    }
+    suggestion_cache.set((key, limit), result)
+    return result
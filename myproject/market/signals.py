@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .models import Product, CartItem
+from . import anonymous_cart
+from .inventory import merge_cart
+from .search import INDEXED_FIELDS, index_products, unindex_products
+from .cache import invalidate_storefront, invalidate_navbar
+
+@receiver(post_init, sender=Product)
+def remember_category(sender, instance, **kwargs):
+    # Needed to invalidate the old category when a product moves to another one
+    instance._loaded_category = instance.category
+    # Read without loading it when deferred (e.g. .only("stock", "category"))
+    instance._loaded_active = instance.__dict__.get("active")
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Saves that only touch stock/active/etc. don't change the search document
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_products([(instance.pk, instance.title, instance.description, instance.brand)])
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_storefront_cache(sender, instance, **kwargs):
+    invalidate_storefront(instance.category, getattr(instance, "_loaded_category", None))
+    instance._loaded_category = instance.category
+
+# Header counters of the users holding the product. Deleting it cascades to their cart
+# items and favorites, and the wishlist count only includes active products; neither
+# goes through the cart or favorites code that drops the cached counters.
+def _invalidate_navbars(product, carts=True):
+    user_ids = set(
+        Product.favorited_by.through.objects.filter(product_id=product.pk).values_list("user_id", flat=True)
+    )
+    if carts:
+        user_ids.update(CartItem.objects.filter(product_id=product.pk).values_list("cart__user_id", flat=True))
+    if user_ids:
+        transaction.on_commit(lambda: invalidate_navbar(*user_ids))
+
+@receiver(pre_delete, sender=Product)
+def invalidate_holders_navbar(sender, instance, **kwargs):
+    _invalidate_navbars(instance)
+
+@receiver(post_save, sender=Product)
+def invalidate_wishlist_navbar(sender, instance, created, **kwargs):
+    active = instance.__dict__.get("active")
+    if not created and active is not None and instance._loaded_active not in (None, active):
+        _invalidate_navbars(instance, carts=False)
+    instance._loaded_active = active
+
+# favorites_count bookkeeping. pk_set on remove holds whatever ids were passed,
+# so the rows that really go away are looked up before the change, and locked:
+# a concurrent remove of the same rows waits, then finds them gone and counts nothing.
+def _favorite_deltas(instance, reverse, pk_set):
+    """Return {product_id: rows} for the favorites rows this change deletes"""
+    Favorite = Product.favorited_by.through
+    if reverse:
+        rows = Favorite.objects.filter(user_id=instance.pk)
+        if pk_set is not None:
+            rows = rows.filter(product_id__in=pk_set)
+    else:
+        rows = Favorite.objects.filter(product_id=instance.pk)
+        if pk_set is not None:
+            rows = rows.filter(user_id__in=pk_set)
+    deltas = {}
+    # remove() and clear() run in a transaction, the lock lasts until the rows are deleted
+    for product_id in rows.select_for_update().values_list("product_id", flat=True):
+        deltas[product_id] = deltas.get(product_id, 0) + 1
+    return deltas
+
+def _apply_favorite_deltas(deltas, sign):
+    # Group products by delta so a whole page of changes costs one UPDATE per distinct delta
+    by_delta = {}
+    for product_id, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(product_id)
+    for delta, product_ids in by_delta.items():
+        products = Product.objects.filter(pk__in=product_ids)
+        if sign < 0:
+            products = products.filter(favorites_count__gte=delta)
+        products.update(favorites_count=F("favorites_count") + sign * delta)
+    if deltas:
+        # update() skips post_save, the cards and the popularity sort show favorites_count
+        categories = set(Product.objects.filter(pk__in=list(deltas)).values_list("category", flat=True))
+        transaction.on_commit(lambda: invalidate_storefront(*categories))
+
+@receiver(m2m_changed, sender=Product.favorited_by.through)
+def update_favorites_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_add" and pk_set:
+        # pk_set only holds the ids that were actually added
+        if reverse:
+            deltas = {product_id: 1 for product_id in pk_set}
+        else:
+            deltas = {instance.pk: len(pk_set)}
+        _apply_favorite_deltas(deltas, +1)
+    elif action in ("pre_remove", "pre_clear"):
+        instance._favorite_deltas = _favorite_deltas(instance, reverse, pk_set)
+    elif action in ("post_remove", "post_clear"):
+        _apply_favorite_deltas(getattr(instance, "_favorite_deltas", {}), -1)
+        instance._favorite_deltas = {}
+
+@receiver(m2m_changed, sender=Product.favorited_by.through)
+def invalidate_wishlist_count(sender, instance, action, reverse, pk_set, **kwargs):
+    # The header shows the wishlist count of every user touched by the change
+    if reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_navbar(instance.pk)
+    elif action == "pre_clear":
+        instance._favorited_by_ids = list(
+            Product.favorited_by.through.objects.filter(product_id=instance.pk).values_list("user_id", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        invalidate_navbar(*(pk_set or ()))
+    elif action == "post_clear":
+        invalidate_navbar(*getattr(instance, "_favorited_by_ids", ()))
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    # Covers every login path (core.views.home, allauth, social accounts)
+    lines = anonymous_cart.read(request) if request is not None else {}
+    if not lines:
+        return
+    for product, wanted, merged in merge_cart(user, lines):
+        messages.warning(
+            request, f'Solo quedaban {merged} de {wanted} unidades de {product.title} para tu carrito',
+            fail_silently=True,
+        )
+    request.anonymous_cart_merged = True
@@ -5,6 +5,7 @@ app_name = "market"
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('suggest/', views.search_suggestions, name='search_suggestions'),
     path('my_products', views.my_product_list, name='my_product_list'),
     path('create/', views.product_create, name='product_create'),
     path('<int:pk>/edit/', views.product_edit, name='product_edit'),
@@ -12,8 +13,12 @@ urlpatterns = [
     path('cart/', views.view_cart, name='view_cart'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/<int:product_id>/', views.update_cart_quantity, name='update_cart_quantity'),
+    path('cart/set/', views.set_cart_quantities, name='set_cart_quantities'),
     path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('wishlist/', views.wishlist, name='wishlist'),
     path('<int:product_id>/wishlist/', views.toggle_favorite, name='toggle_favorite'),
+    path('orders/', views.order_history, name='order_history'),
     path('cart/checkout/', views.process_cart_payment, name='process_cart_payment'),
+    path('cart/checkout/success/', views.payment_success, name='payment_success'),
+    path('cart/checkout/webhook/', views.mercadopago_webhook, name='mercadopago_webhook'),
 ]
\ No newline at end of file
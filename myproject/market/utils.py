@@ -0,0 +1,55 @@
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Product, CartItem
+
+def attach_favorite_flags(products, user):
+    """
+    Set `is_favorited` on every product for the given user with a single query,
+    instead of checking `product.favorited_by.all` once per card
+    """
+    products = list(products)
+    favorite_ids = set()
+    if user.is_authenticated and products:
+        favorite_ids = set(
+            Product.favorited_by.through.objects
+            .filter(user_id=user.pk, product_id__in=[product.pk for product in products])
+            .values_list("product_id", flat=True)
+        )
+    for product in products:
+        product.is_favorited = product.pk in favorite_ids
+    return products
+
+def favorites_count_subquery():
+    """Exact number of favorites of the outer product, for bulk UPDATEs"""
+    return Coalesce(Subquery(
+        Product.favorited_by.through.objects
+        .filter(product_id=OuterRef("pk"))
+        .order_by().values("product_id").annotate(total=Count("*")).values("total")
+    ), 0)
+
+
+def in_stock_q():
+    """
+    Products with units left to hold: on-hand stock above the units of live cart holds,
+    the same figure attach_available_stock() shows on the cards
+    """
+    held = Coalesce(Subquery(
+        CartItem.objects.filter(product_id=OuterRef("pk"), held_until__gt=timezone.now())
+        .order_by().values("product_id").annotate(held=Sum("quantity")).values("held")
+    ), 0)
+    return Q(stock__gt=held)
+
+def category_facets(products):
+    """
+    Count products per category in a single grouped query
+
+    Returns:
+        {category: {"total": n, "in_stock": n}}
+    """
+    rows = (
+        products.order_by()
+        .values("category")
+        .annotate(total=Count("id"), in_stock=Count("id", filter=in_stock_q()))
+    )
+    return {row["category"]: {"total": row["total"], "in_stock": row["in_stock"]} for row in rows}
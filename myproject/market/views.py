@@ -1,74 +1,176 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
 from .forms import ProductForm
-from .models import Product, Cart, CartItem
+from .models import Product, Cart, CartItem, Order, PaymentNotification, CENTS
+from .pagination import KeysetPage, KeysetPaginator, InvalidCursor, product_listing_paginator, SORT_CHOICES, SORT_ORDERINGS
+from .utils import attach_favorite_flags, in_stock_q
+from .search import suggest
+from . import inventory, anonymous_cart
+from .orders import order_history_paginator
+from .payments import checkout_preference, enqueue_payment, is_payment_id, finalize_payments, verify_webhook_signature
+from .cache import storefront_cache_key, get_storefront_fragment, set_storefront_fragment, cached_category_facets
+from market_ai.search import semantic_search
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Q
-from django.core.paginator import Paginator
+from django.http import JsonResponse, Http404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.cache import patch_cache_control
+from django.middleware.csrf import get_token
 from django.conf import settings
-import mercadopago
-import environ
+import json
 
-env = environ.Env()
+CSRF_PLACEHOLDER = "__csrf_token__"
+# Semantic searches show the closest matches on a single page
+SEMANTIC_RESULTS = 48
+
+def _listing_filters(request):
+    """
+    Read the listing filters from the cursor token when paginating, otherwise from the query string
+
+    Returns ({"category", "search", "sort", "in_stock", "semantic"}, cursor), semantic results
+    are a single page so they never come from a cursor
+    """
+    cursor = request.GET.get('cursor', '')
+    if cursor:
+        try:
+            filters = KeysetPaginator.read_cursor(cursor).get("f", {})
+            return {
+                "category": filters.get("category", ""),
+                "search": filters.get("search", ""),
+                "sort": filters.get("sort", ""),
+                "in_stock": bool(filters.get("in_stock")),
+                "semantic": False,
+            }, cursor
+        except InvalidCursor:
+            cursor = ''
+    sort = request.GET.get('sort', '')
+    if sort not in SORT_ORDERINGS:
+        sort = ''
+    return {
+        "category": request.GET.get('category', ''),
+        "search": request.GET.get('search', ''),
+        "sort": sort,
+        "in_stock": request.GET.get('in_stock') == '1',
+        "semantic": request.GET.get('mode') == 'semantic',
+    }, cursor
+
+def _paginate_products(products, filters, cursor):
+    paginator = product_listing_paginator(
+        products, **{name: filters[name] for name in ("category", "search", "sort", "in_stock")}
+    )
+    try:
+        return paginator.get_page(cursor, with_count=True)
+    except InvalidCursor:
+        return paginator.get_page(None, with_count=True)
+
+def _semantic_page(products, filters):
+    """Single page of the products closest in meaning to the search, None if it's unavailable"""
+    if filters["category"]:
+        products = products.filter(category=filters["category"])
+    if filters["in_stock"]:
+        products = products.filter(in_stock_q())
+    results = semantic_search(products, filters["search"], SEMANTIC_RESULTS)
+    if results is None:
+        return None
+    if filters["sort"]:
+        # Explicit sort modes reorder the closest matches
+        ordering = SORT_ORDERINGS[filters["sort"]]
+        results = list(products.filter(pk__in=[product.pk for product in results]).order_by(*ordering))
+    return KeysetPage(results, False, False, None, None, count=len(results), count_is_exact=True)
+
+def _listing_context(filters, facets):
+    return {
+        "categories": [
+            (value, label, facets.get(value, {}).get("in_stock" if filters["in_stock"] else "total", 0))
+            for value, label in Product.CATEGORY_CHOICES
+        ],
+        "sort_choices": SORT_CHOICES,
+        "selected_category": filters["category"],
+        "search_query": filters["search"],
+        "selected_sort": filters["sort"],
+        "in_stock": filters["in_stock"],
+        "semantic": filters["semantic"],
+    }
 
 def product_list(request):
+    filters, cursor = _listing_filters(request)
     if not request.user.is_anonymous:
-        products = Product.objects.filter(active=True).exclude(seller=request.user).order_by("-created_at")
+        products = Product.objects.filter(active=True).exclude(seller=request.user)
     else:
-        products = Product.objects.filter(active=True).order_by("-created_at")
-    category_filter = request.GET.get('category', '')
-    search_query = request.GET.get('search', '')
-
-    if category_filter:
-        products = products.filter(category=category_filter)
-
-    if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        )
+        products = Product.objects.filter(active=True)
 
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    categories = Product.CATEGORY_CHOICES
+    # Every anonymous visitor sees the same grid for the same filters, so it is shared.
+    # The page around it isn't cached since the login modals carry a CSRF token
+    cache_key = None
+    product_grid = None
+    if request.user.is_anonymous:
+        cache_key = storefront_cache_key(filters, cursor)
+        product_grid = get_storefront_fragment(cache_key)
+
+    if product_grid is None:
+        page_obj = None
+        if filters["semantic"] and filters["search"]:
+            page_obj = _semantic_page(products, filters)
+            if page_obj is None:
+                # Embedding API down or nothing indexed yet: keyword results, not shared
+                messages.info(request, "La búsqueda por significado no está disponible, se muestran resultados por palabras.")
+                cache_key = None
+        if page_obj is None:
+            page_obj = _paginate_products(products, filters, cursor)
+        attach_favorite_flags(page_obj, request.user)
+        inventory.attach_available_stock(page_obj)
+        context = {
+            "page_obj": page_obj,
+            "selected_category": filters["category"],
+            "search_query": filters["search"],
+            "selected_sort": filters["sort"],
+            "in_stock": filters["in_stock"],
+            "semantic": filters["semantic"],
+        }
+        if cache_key:
+            # Shared fragments carry a placeholder instead of this visitor's CSRF token
+            context["csrf_token"] = CSRF_PLACEHOLDER
+        product_grid = render_to_string("product_list_grid.html", context, request=request)
+        if cache_key:
+            set_storefront_fragment(cache_key, product_grid, semantic=filters["semantic"])
+    if cache_key:
+        product_grid = product_grid.replace(CSRF_PLACEHOLDER, get_token(request))
+
+    # Facets are shared by every storefront visitor, so they include the visitor's own products.
+    # Semantic matches aren't keyword matches, their categories show the whole catalog counts
+    facets = cached_category_facets(
+        "storefront", "" if filters["semantic"] else filters["search"], Product.objects.filter(active=True)
+    )
 
     return render(request, "product_list.html", {
-        "page_obj": page_obj,
-        "categories": categories,
-        "selected_category": category_filter,
-        "search_query": search_query,
+        "product_grid": mark_safe(product_grid),
+        **_listing_context(filters, facets),
+    })
+
+def search_suggestions(request):
+    """Title and brand completions for the storefront search box"""
+    result = suggest(Product.objects.filter(active=True), request.GET.get('q', ''))
+    response = JsonResponse({
+        'suggestions': [{'text': title, 'type': 'title'} for title in result['titles']] +
+                       [{'text': brand, 'type': 'brand'} for brand in result['brands']],
     })
+    # Same answer for everyone, browsers and proxies can reuse it while typing
+    patch_cache_control(response, public=True, max_age=settings.SUGGEST_CACHE_TIMEOUT)
+    return response
 
 @login_required
 def my_product_list(request):
-    products = Product.objects.filter(active=True, seller=request.user).order_by("-created_at")
-    category_filter = request.GET.get('category', '')
-    search_query = request.GET.get('search', '')
-
-    if category_filter:
-        products = products.filter(category=category_filter)
-
-    if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        )
-
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    categories = Product.CATEGORY_CHOICES
+    products = Product.objects.filter(active=True, seller=request.user)
+    filters, cursor = _listing_filters(request)
+    page_obj = _paginate_products(products, filters, cursor)
+    facets = cached_category_facets(f"seller:{request.user.pk}", filters["search"], products)
 
     return render(request, "my_product_list.html", {
         "page_obj": page_obj,
-        "categories": categories,
-        "selected_category": category_filter,
-        "search_query": search_query,
+        **_listing_context(filters, facets),
     })
 
 #Create Product
@@ -116,95 +218,194 @@ def product_delete(request, pk):
         return redirect("market:my_product_list")
     return render(request, "my_product_list.html", {"product": product})
 
+def _is_ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def _cart_response(request, totals, changed, anonymous_lines=None, message=None):
+    """
+    Response of a successful cart action. AJAX requests get only the changed lines and the
+    new cart totals, the rest are redirected to the cart. Anonymous carts are written back
+    to their cookie
+
+    Args:
+        totals: Cart.totals() / CartSummary.totals()
+        changed: [(Product, new quantity, 0 when it was removed)]
+        anonymous_lines: The cookie cart of a visitor, None for users
+    """
+    if _is_ajax(request):
+        held = inventory.held_quantities([product.pk for product, quantity in changed])
+        response = JsonResponse({
+            'success': True,
+            'lines': [{
+                'product_id': product.pk,
+                'quantity': quantity,
+                'subtotal': str((product.price * quantity).quantize(CENTS)),
+                'available': max(product.stock - held.get(product.pk, 0), 0),
+            } for product, quantity in changed],
+            'cart_total': str(totals['total']),
+            'cart_count': totals['lines'],
+            'cart_quantity': totals['quantity'],
+        })
+    else:
+        if message:
+            messages.success(request, message)
+        response = redirect("market:view_cart")
+
+    if anonymous_lines is not None:
+        anonymous_cart.write(response, anonymous_lines)
+    return response
+
+def _cart_error(request, message, status, fallback):
+    if _is_ajax(request):
+        return JsonResponse({'success': False, 'message': message}, status=status)
+    if status == 404:
+        raise Http404(message)
+    messages.error(request, message)
+    return redirect(fallback)
+
 #Add to Cart
-@login_required
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
+    back = request.META.get('HTTP_REFERER', 'market:product_list')
     
     # Get quantity from POST request, default to 1
-    quantity = int(request.POST.get('quantity', 1))
-    
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    item, item_created = CartItem.objects.get_or_create(cart=cart, product=product)
-    
-    # Calculate new total quantity in cart
-    new_quantity = item.quantity + quantity if not item_created else quantity
-    
-    # Check if there's enough stock for the total quantity
-    if new_quantity > product.stock:
-        messages.error(request, f'Solo hay {product.stock} unidades disponibles')
-        return redirect(request.META.get('HTTP_REFERER', 'market:product_list'))
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        quantity = 0
     
-    # Update cart item quantity
-    item.quantity = new_quantity
-    item.save()
-
-    # Decrease product stock
-    product.stock -= quantity
-    product.save()
+    try:
+        if quantity < 1:
+            raise ValueError('quantity must be positive')
+        if request.user.is_anonymous:
+            # Visitors keep the cart in a cookie, nothing is written to the database
+            lines = anonymous_cart.read(request)
+            lines = anonymous_cart.update(lines, {product: lines.get(product.pk, 0) + quantity})
+            return _cart_response(
+                request, anonymous_cart.summary(lines).totals(), [(product, lines[product.pk])],
+                anonymous_lines=lines, message=f'{quantity} producto(s) agregado(s) al carrito',
+            )
+        # Holds the units for the cart, stock is only taken when the cart is paid
+        item = inventory.add_to_cart(request.user, product, quantity)
+    except inventory.OutOfStock as e:
+        return _cart_error(request, f'Solo hay {e.available} unidades disponibles', 409, back)
+    except ValueError:
+        return _cart_error(request, 'Cantidad inválida', 400, back)
     
-    messages.success(request, f'{quantity} producto(s) agregado(s) al carrito')
-    return redirect("market:view_cart")
+    return _cart_response(
+        request, item.cart.totals(), [(product, item.quantity)],
+        message=f'{quantity} producto(s) agregado(s) al carrito',
+    )
 
 #Delete from Cart
-@login_required
 def remove_from_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
 
-    # Restore stock when removing from cart
-    product.stock += cart_item.quantity
-    product.active = True 
-    product.save()
+    if request.user.is_anonymous:
+        lines = anonymous_cart.read(request)
+        if product.pk not in lines:
+            return _cart_error(request, 'Producto no encontrado en el carrito', 404, "market:view_cart")
+        lines.pop(product.pk)
+        return _cart_response(
+            request, anonymous_cart.summary(lines).totals(), [(product, 0)],
+            anonymous_lines=lines, message='Producto eliminado del carrito',
+        )
 
-    cart_item.delete()
-    messages.success(request, 'Producto eliminado del carrito')
-    return redirect("market:view_cart")
+    # Releases the hold on the removed units
+    try:
+        item = inventory.remove_from_cart(request.user, product)
+    except CartItem.DoesNotExist:
+        return _cart_error(request, 'Producto no encontrado en el carrito', 404, "market:view_cart")
+
+    return _cart_response(request, item.cart.totals(), [(product, 0)], message='Producto eliminado del carrito')
 
 #View Cart
-@login_required
 def view_cart(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return render(request, "shopping_cart.html", {"cart": cart})
+    if request.user.is_anonymous:
+        cart = None
+        summary = anonymous_cart.summary(anonymous_cart.read(request))
+    else:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        summary = cart.summary()
+    inventory.attach_available_stock([item.product for item in summary])
+    return render(request, "shopping_cart.html", {"cart": cart, "summary": summary})
 
 #Update Cart
-@login_required
 def update_cart_quantity(request, product_id):
     if request.method == "POST":
         product = get_object_or_404(Product, id=product_id)
-        cart = get_object_or_404(Cart, user=request.user)
-        cart_item = get_object_or_404(CartItem, cart=cart, product=product)
         
         action = request.POST.get('action')
+        delta = {'increase': 1, 'decrease': -1}.get(action)
         
-        if action == 'increase':
-            if product.stock >= 1:
-                cart_item.quantity += 1
-                product.stock -= 1
-                cart_item.save()
-                product.save()
-                messages.success(request, 'Cantidad actualizada')
-            else:
-                messages.error(request, 'No hay mas stock disponible')
-        
-        elif action == 'decrease':
-            if cart_item.quantity > 1:
-                cart_item.quantity -= 1
-                product.stock += 1
-                cart_item.save()
-                product.save()
-                messages.success(request, 'Cantidad actualizada')
-            else:
-                messages.error(request, 'La cantidad mínima es 1')
+        if delta:
+            try:
+                if request.user.is_anonymous:
+                    lines = anonymous_cart.read(request)
+                    if product.pk not in lines:
+                        raise CartItem.DoesNotExist
+                    if lines[product.pk] + delta < 1:
+                        raise ValueError("quantity can't go below 1")
+                    lines = anonymous_cart.update(lines, {product: lines[product.pk] + delta})
+                    return _cart_response(
+                        request, anonymous_cart.summary(lines).totals(), [(product, lines[product.pk])],
+                        anonymous_lines=lines, message='Cantidad actualizada',
+                    )
+                item = inventory.change_quantity(request.user, product, delta)
+            except CartItem.DoesNotExist:
+                return _cart_error(request, 'Producto no encontrado en el carrito', 404, "market:view_cart")
+            except inventory.OutOfStock:
+                return _cart_error(request, 'No hay mas stock disponible', 409, "market:view_cart")
+            except ValueError:
+                return _cart_error(request, 'La cantidad mínima es 1', 400, "market:view_cart")
+            
+            return _cart_response(request, item.cart.totals(), [(product, item.quantity)], message='Cantidad actualizada')
     
     return redirect("market:view_cart")
 
+#Set several cart quantities at once (JSON)
+@require_POST
+def set_cart_quantities(request):
+    """
+    Body: {"items": [{"product_id": 1, "quantity": 3}, ...]}, quantity 0 removes the product.
+    Applies every change or none
+    """
+    try:
+        wanted = {int(line['product_id']): int(line['quantity']) for line in json.loads(request.body)['items']}
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Pedido inválido'}, status=400)
+
+    products = Product.objects.in_bulk(list(wanted))
+    if len(products) != len(wanted):
+        return JsonResponse({'success': False, 'message': 'Producto no encontrado'}, status=404)
+    quantities = {product: wanted[pk] for pk, product in products.items()}
+
+    try:
+        if request.user.is_anonymous:
+            lines = anonymous_cart.update(anonymous_cart.read(request), quantities)
+            return _cart_response(
+                request, anonymous_cart.summary(lines).totals(),
+                [(products[pk], lines.get(pk, 0)) for pk in wanted], anonymous_lines=lines,
+            )
+        items = inventory.set_quantities(request.user, quantities)
+    except inventory.OutOfStock as e:
+        return JsonResponse(
+            {'success': False, 'message': f'Solo hay {e.available} unidades disponibles de {e.product.title}'},
+            status=409,
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Cantidad inválida'}, status=400)
+
+    cart = Cart.objects.get(user=request.user)
+    return _cart_response(
+        request, cart.totals(), [(products[pk], items[pk].quantity if items[pk] else 0) for pk in wanted]
+    )
+
 @login_required
 def toggle_favorite(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     
-    if request.user in product.favorited_by.all():
+    if product.favorited_by.filter(pk=request.user.pk).exists():
         product.favorited_by.remove(request.user)
         is_favorited = False
         message = 'Producto eliminado de la lista de deseos'
@@ -223,46 +424,49 @@ def toggle_favorite(request, product_id):
 
 @login_required
 def wishlist(request):
-    favorite_products = Product.objects.filter(favorited_by=request.user, active=True)
+    favorite_products = list(Product.objects.filter(favorited_by=request.user, active=True))
+    # Everything listed here is a favorite already, no lookup needed
+    for product in favorite_products:
+        product.is_favorited = True
+    inventory.attach_available_stock(favorite_products)
     return render(request, "wishlist.html", {"products": favorite_products})
 
+@login_required
+def order_history(request):
+    """The user's purchases, newest first, one keyset page (a single indexed query) at a time"""
+    paginator = order_history_paginator(request.user)
+    try:
+        page_obj = paginator.get_page(request.GET.get('cursor') or None)
+    except InvalidCursor:
+        page_obj = paginator.get_page(None)
+    return render(request, "order_history.html", {"page_obj": page_obj})
+
 @login_required
 @require_POST
 def process_cart_payment(request):
     try:
         cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.all()
-        api_key = env("MERCADOPAGO_ACCESS_TOKEN")
+        cart_items = cart.summary()
         
         if not cart_items:
             return JsonResponse({'error': 'Carrito vacío'}, status=400)
         
-        # Initialize MercadoPago SDK
-        sdk = mercadopago.SDK(api_key)
-        
-        # Prepare items for MercadoPago
-        items = []
-        for item in cart_items:
-            items.append({
-                "title": item.product.title,
-                "quantity": item.quantity,
-                "unit_price": float(item.product.price),
-                "currency_id": "ARS",
-            })
+        # Keep the units reserved while the buyer is paying
+        try:
+            inventory.renew_holds(cart)
+        except inventory.OutOfStock as e:
+            return JsonResponse(
+                {'error': f'Solo hay {e.available} unidades disponibles de {e.product.title}'}, status=409
+            )
         
-        # Create preference
-        preference_data = {
-            "items": items,
-            "back_urls": {
-                "success": request.build_absolute_uri("/pago-exitoso/"),
-                "failure": request.build_absolute_uri("/products/cart/"),
-                "pending": request.build_absolute_uri("/pago-pendiente/"),
-            },
-            "auto_return": "approved",
-        }
-        preference = sdk.preference().create(preference_data)
+        # Paying the same cart again reuses its preference, without calling Mercado Pago
+        init_point, created = checkout_preference(cart, cart_items, {
+            "success": request.build_absolute_uri(reverse("market:payment_success")),
+            "failure": request.build_absolute_uri("/products/cart/"),
+            "pending": request.build_absolute_uri("/pago-pendiente/"),
+        })
         return JsonResponse({
-            "init_point": preference["response"]["init_point"]
+            "init_point": init_point
         })
         
         
@@ -271,20 +475,56 @@ def process_cart_payment(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-""" @login_required
-def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
-    
-    # Decrease stock for all items
-    for item in cart.items.all():
-        product = item.product
-        product.stock -= item.quantity
-        if product.stock == 0:
-            product.active = False
-        product.save()
-    
-    # Clear cart after purchase
-    cart.items.all().delete()
-    
-    messages.success(request, '¡Compra realizada exitosamente!')
-    return redirect('market:product_list') """
\ No newline at end of file
+@login_required
+def payment_success(request):
+    """Mercado Pago return URL: finalize the buyer's payment right away instead of waiting for the worker"""
+    payment_id = request.GET.get('payment_id', '')
+    if not is_payment_id(payment_id):
+        return redirect("market:view_cart")
+
+    # Same queue as the webhook, so the payment is finalized once whoever gets there first.
+    # The query string can be forged, the worker reads the payment back from Mercado Pago
+    enqueue_payment(payment_id)
+    finalize_payments(payment_ids=[payment_id])
+    notification = PaymentNotification.objects.get(payment_id=payment_id)
+
+    if notification.processed_at is None:
+        messages.info(request, 'Estamos procesando tu pago, te avisaremos cuando se acredite')
+        return redirect("market:product_list")
+    own = Order.objects.filter(pk=notification.order_id, user=request.user).exists()
+    if not own or notification.result not in ('approved', 'shortage', 'flagged'):
+        messages.error(request, 'El pago no fue aprobado')
+        return redirect("market:view_cart")
+    if notification.result == 'flagged':
+        messages.warning(request, 'Recibimos tu pago, pero no coincide con tu pedido: lo estamos revisando')
+        return redirect("market:view_cart")
+
+    if notification.result == 'shortage':
+        messages.warning(request, f'Pago aprobado, pero no quedó stock de: {notification.detail}')
+    else:
+        messages.success(request, '¡Pago aprobado! Gracias por tu compra')
+    return redirect("market:order_history")
+
+@csrf_exempt
+@require_POST
+def mercadopago_webhook(request):
+    """
+    Mercado Pago notifications: check the signature and queue the payment, nothing else.
+    `manage.py process_payments` finalizes the queued payments in batches
+    """
+    data_id = request.GET.get('data.id') or request.GET.get('id')
+    if not data_id:
+        try:
+            data_id = str(json.loads(request.body)["data"]["id"])
+        except (ValueError, KeyError, TypeError):
+            data_id = None
+
+    if not verify_webhook_signature(
+        request.headers.get('x-signature'), request.headers.get('x-request-id'), data_id
+    ):
+        return JsonResponse({'error': 'invalid signature'}, status=403)
+
+    topic = request.GET.get('type') or request.GET.get('topic')
+    if topic == 'payment' and data_id and is_payment_id(data_id):
+        enqueue_payment(data_id)
+    return JsonResponse({'received': True})
@@ -1,4 +1,9 @@
 from django.contrib import admin
-from .models import ProductEmbedding
+from .models import ProductEmbedding, EmbeddingJob
 
-admin.site.register(ProductEmbedding)
\ No newline at end of file
+admin.site.register(ProductEmbedding)
+
+
+@admin.register(EmbeddingJob)
+class EmbeddingJobAdmin(admin.ModelAdmin):
+    list_display = ("product", "requested_at", "retry_at", "attempts", "last_error")
@@ -0,0 +1,289 @@
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from .models import ProductEmbedding
+from .vectors import DTYPE, REFRESH_INTERVAL, SyncedEmbeddings, normalize, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+# Inverted file (IVF) index: the vectors are split into lists around k-means centroids and a
+# query only scores the lists of its NPROBE nearest centroids. With ~2*sqrt(N) lists a query
+# at 1M products reads about 1/120 of the catalog.
+NPROBE = 16
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 32  # Training vectors per list, at most
+# Lists drift as products are added, retrain once the index is this many times its trained size
+REBUILD_GROWTH = 4
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def default_nlist(size):
+    return max(1, min(4096, int(2 * math.sqrt(size))))
+
+
+def train_centroids(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means over unit vectors, on a sample of at most KMEANS_SAMPLE per list"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > nlist * KMEANS_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), nlist * KMEANS_SAMPLE, replace=False)]
+    nlist = min(nlist, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = _nearest(centroids, vectors)
+        counts = np.bincount(assigned, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        empty = counts == 0
+        sums[~empty] = np.add.reduceat(vectors[np.argsort(assigned, kind="stable")], starts[~empty], axis=0)
+        # Empty lists restart from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(DTYPE)
+
+
+def _nearest(centroids, vectors, chunk=8192):
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+class _List:
+    """Vectors of one inverted list, growing by doubling, removals swap in the last row"""
+
+    def __init__(self, dimensions, ids=None, vectors=None):
+        self.ids = np.empty(0, dtype=np.int64) if ids is None else ids
+        self.vectors = np.empty((0, dimensions), dtype=DTYPE) if vectors is None else vectors
+        self.size = len(self.ids)
+
+    def append(self, product_id, vector):
+        if self.size == len(self.ids):
+            capacity = max(16, self.size * 2)
+            ids = np.empty(capacity, dtype=np.int64)
+            ids[:self.size] = self.ids[:self.size]
+            vectors = np.empty((capacity, self.vectors.shape[1]), dtype=DTYPE)
+            vectors[:self.size] = self.vectors[:self.size]
+            self.ids, self.vectors = ids, vectors
+        self.ids[self.size] = product_id
+        self.vectors[self.size] = vector
+        self.size += 1
+        return self.size - 1
+
+    def pop(self, row):
+        """Remove the row, returns the product id moved into it (None if it was the last one)"""
+        self.size -= 1
+        if row == self.size:
+            return None
+        self.ids[row] = self.ids[self.size]
+        self.vectors[row] = self.vectors[self.size]
+        return int(self.ids[row])
+
+
+class IVFIndex(SyncedEmbeddings):
+    """
+    Approximate nearest neighbours over the product embeddings (cosine similarity).
+    Products are inserted into the list of their nearest centroid and deleted in place, kept
+    in sync with the database by refresh(). save()/load() persist it so workers start warm.
+    """
+
+    def __init__(self, centroids, model=None):
+        super().__init__(model)
+        self.centroids = centroids
+        self.trained_size = 0
+        self._lists = [_List(centroids.shape[1]) for _ in range(len(centroids))]
+        self._where = {}  # product id -> (list, row)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, product_id):
+        return product_id in self._where
+
+    @property
+    def dimensions(self):
+        return self.centroids.shape[1]
+
+    @classmethod
+    def from_vectors(cls, ids, vectors, nlist=None, model=None):
+        """Train the centroids on vectors (unit rows) and insert them all"""
+        ids = np.asarray(ids, dtype=np.int64)
+        index = cls(train_centroids(vectors, nlist or default_nlist(len(ids))), model)
+        index.trained_size = len(ids)
+        assigned = _nearest(index.centroids, vectors)
+        order = np.argsort(assigned, kind="stable")
+        bounds = np.searchsorted(assigned[order], np.arange(len(index.centroids) + 1))
+        for number in range(len(index.centroids)):
+            rows = order[bounds[number]:bounds[number + 1]]
+            index._lists[number] = _List(index.dimensions, ids[rows], vectors[rows])
+            index._where.update((int(pk), (number, row)) for row, pk in enumerate(ids[rows]))
+        return index
+
+    @classmethod
+    def build(cls, model=None, nlist=None):
+        """Index every ProductEmbedding of the model, in bulk"""
+        model = model or settings.EMBEDDING_MODEL
+        rows = ProductEmbedding.objects.filter(model=model).values_list("product_id", "vector", "updated_at")
+        ids, vectors, stamps = [], [], {}
+        for product_id, data, updated_at in rows.iterator(2000):
+            ids.append(product_id)
+            vectors.append(unpack_vector(data))
+            stamps[product_id] = updated_at
+        if not ids:
+            return None
+        vectors = np.vstack(vectors)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        index = cls.from_vectors(ids, vectors, nlist, model)
+        index._stamps = stamps
+        index._since = max(stamps.values())
+        return index
+
+    def _put(self, product_id, vector):
+        if vector.shape[0] != self.dimensions:
+            logger.warning(f"Embedding of product {product_id} has {vector.shape[0]} dimensions, skipped")
+            return False
+        if product_id in self._where:
+            self._remove(product_id)
+        vector = normalize(vector)
+        number = int(np.argmax(self.centroids @ vector))
+        self._where[product_id] = (number, self._lists[number].append(product_id, vector))
+
+    def _remove(self, product_id):
+        number, row = self._where.pop(product_id)
+        moved = self._lists[number].pop(row)
+        if moved is not None:
+            self._where[moved] = (number, row)
+
+    def add(self, product_id, vector):
+        """Insert or replace a vector outside of refresh(), e.g. for benchmarks"""
+        with self._lock:
+            if self._put(product_id, np.asarray(vector, dtype=DTYPE)) is not False:
+                self._stamps[product_id] = None
+
+    def delete(self, product_id):
+        with self._lock:
+            self._stamps.pop(product_id, None)
+            if product_id in self._where:
+                self._remove(product_id)
+
+    def vector(self, product_id):
+        """Unit vector of the product, None if it isn't indexed"""
+        with self._lock:
+            if product_id not in self._where:
+                return None
+            number, row = self._where[product_id]
+            return self._lists[number].vectors[row].copy()
+
+    def search(self, query, k=10, nprobe=NPROBE, exclude=()):
+        """[(product id, similarity)] of about the k products closest to query, best first"""
+        query = normalize(np.asarray(query, dtype=DTYPE))
+        with self._lock:
+            nprobe = min(nprobe, len(self.centroids))
+            probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            lists = [self._lists[number] for number in probed if self._lists[number].size]
+            if not lists:
+                return []
+            ids = np.concatenate([lst.ids[:lst.size] for lst in lists])
+            scores = np.concatenate([lst.vectors[:lst.size] @ query for lst in lists])
+        if exclude:
+            keep = ~np.isin(ids, list(exclude))
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def save(self, path):
+        """Write the index to path atomically, readers never see a partial file"""
+        with self._lock:
+            sizes = np.array([lst.size for lst in self._lists], dtype=np.int64)
+            ids = np.concatenate([lst.ids[:lst.size] for lst in self._lists])
+            vectors = np.concatenate([lst.vectors[:lst.size] for lst in self._lists])
+            synced = [pk for pk, stamp in self._stamps.items() if stamp is not None]
+            state = {
+                "model": np.array(self.model),
+                "centroids": self.centroids,
+                "trained_size": np.array(self.trained_size),
+                "sizes": sizes,
+                "ids": ids,
+                "vectors": vectors,
+                "stamp_ids": np.array(synced, dtype=np.int64),
+                "stamps": np.array([(self._stamps[pk] - _EPOCH) // _MICROSECOND for pk in synced], dtype=np.int64),
+                "since": np.array(-1 if self._since is None else (self._since - _EPOCH) // _MICROSECOND),
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as out:
+            np.savez(out, **state)
+        os.replace(out.name, path)
+
+    @classmethod
+    def load(cls, path, model=None):
+        """The index saved at path, None if there is none or it holds another model"""
+        model = model or settings.EMBEDDING_MODEL
+        try:
+            state = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        with state:
+            if str(state["model"]) != model:
+                return None
+            index = cls(state["centroids"], model)
+            index.trained_size = int(state["trained_size"])
+            ids, vectors = state["ids"], state["vectors"]
+            start = 0
+            for number, size in enumerate(state["sizes"]):
+                index._lists[number] = _List(index.dimensions, ids[start:start + size], vectors[start:start + size])
+                index._where.update((int(pk), (number, row)) for row, pk in enumerate(ids[start:start + size]))
+                start += size
+            index._stamps = {
+                int(pk): _EPOCH + int(stamp) * _MICROSECOND
+                for pk, stamp in zip(state["stamp_ids"], state["stamps"])
+            }
+            since = int(state["since"])
+            index._since = None if since < 0 else _EPOCH + since * _MICROSECOND
+        return index
+
+
+_index = None
+_index_source = None  # (st_mtime_ns of the file, model) _index was loaded for
+_index_lock = threading.Lock()
+
+
+def similar_products_index():
+    """
+    The process-wide IVFIndex, loaded from settings.EMBEDDING_INDEX_PATH and loaded again
+    whenever `manage.py build_embedding_index` rewrites the file, refreshed at most every
+    REFRESH_INTERVAL seconds in between. Requests never build it: None until the
+    command has saved an index of EMBEDDING_MODEL
+    """
+    global _index, _index_source
+    path = settings.EMBEDDING_INDEX_PATH
+    try:
+        source = (os.stat(path).st_mtime_ns, settings.EMBEDDING_MODEL)
+    except FileNotFoundError:
+        source = None
+    with _index_lock:
+        index = _index
+        stale = source != _index_source
+        if stale:
+            # Other threads keep using the current index while this one loads the new file
+            _index_source = source
+    if stale:
+        index = IVFIndex.load(path) if source is not None else None
+        with _index_lock:
+            if _index_source == source:
+                _index = index
+    if index is None:
+        return None
+    if index.refreshed is None or time.monotonic() - index.refreshed >= REFRESH_INTERVAL:
+        index.refresh()
+    return index
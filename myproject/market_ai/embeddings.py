@@ -0,0 +1,187 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from market.models import Product
+from .gemini_client import embed_texts, AIClientError, EMBEDDING_BATCH_LIMIT
+from .models import EmbeddingJob, ProductEmbedding
+from .vectors import pack_vector
+
+logger = logging.getLogger(__name__)
+
+# Product saves only upsert an EmbeddingJob row, in the same transaction as the product.
+# process_embedding_jobs claims due jobs with a lease, embeds them in batches of up to
+# EMBEDDING_BATCH_LIMIT texts per API call with at most `concurrency` calls in flight,
+# and retries failed batches with exponential backoff. Products whose text hash and
+# model match their stored embedding are dropped without calling the API.
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 6
+
+# Product fields that make up the embedded text, saves touching none of them aren't queued
+EMBEDDED_FIELDS = ("title", "description", "brand")
+
+# Counters of texts embedded and of embeddings avoided, shared through the cache
+STATS_PREFIX = "market_ai:embedding_stats"
+STATS = {
+    "embedded": "Texts sent to the embedding API",
+    "skipped_save": "Saves not queued (no embedded field changed)",
+    "skipped_unchanged": "Queued products not re-embedded (same text and model)",
+    "query_embedded": "Search queries sent to the embedding API",
+    "query_cached": "Search queries answered from the cache",
+}
+
+
+def count(name, amount=1):
+    if not amount:
+        return
+    key = f"{STATS_PREFIX}:{name}"
+    if not cache.add(key, amount, timeout=None):
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, amount, timeout=None)
+
+
+def embedding_stats():
+    """{counter name: value} of the STATS counters"""
+    values = cache.get_many([f"{STATS_PREFIX}:{name}" for name in STATS])
+    return {name: values.get(f"{STATS_PREFIX}:{name}", 0) for name in STATS}
+
+
+def product_text(product):
+    """Text embedded for a product"""
+    return f"{product.title}. {product.description or ''}. Marca: {product.brand or ''}"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def enqueue_products(product_ids):
+    """Ask for the embeddings of the products to be (re)computed, one upsert whatever the count"""
+    now = timezone.now()
+    EmbeddingJob.objects.bulk_create(
+        [
+            EmbeddingJob(product_id=pk, requested_at=now, retry_at=now, attempts=0, last_error="")
+            for pk in product_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["requested_at", "retry_at", "attempts", "last_error"],
+    )
+
+
+def _claim(limit):
+    """Lease up to limit due jobs so concurrent workers don't embed them twice"""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            EmbeddingJob.objects.select_for_update(skip_locked=True)
+            .filter(retry_at__lte=now).order_by("retry_at")[:limit]
+        )
+        EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(retry_at=now + LEASE)
+    return jobs
+
+
+def _embed_batch(texts):
+    """(vectors, error) for a batch of texts, run in the worker threads"""
+    try:
+        return embed_texts(texts, model=settings.EMBEDDING_MODEL), ""
+    except AIClientError as e:
+        return None, str(e)
+
+
+def _finish(jobs):
+    # Jobs requested again meanwhile stay queued, due right away
+    done = reduce(or_, (Q(pk=job.pk, requested_at=job.requested_at) for job in jobs))
+    EmbeddingJob.objects.filter(done).delete()
+    EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(retry_at=timezone.now())
+
+
+def _save(jobs, products, texts, vectors):
+    ProductEmbedding.objects.bulk_create(
+        [
+            ProductEmbedding(
+                product=product, model=settings.EMBEDDING_MODEL, vector=pack_vector(vector),
+                content_hash=text_hash(text),
+            )
+            for product, text, vector in zip(products, texts, vectors)
+        ],
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["model", "vector", "content_hash", "updated_at"],
+    )
+    _finish(jobs)
+
+
+def _retry(jobs, error):
+    now = timezone.now()
+    for job in jobs:
+        job.attempts += 1
+        job.last_error = error
+        job.retry_at = now + timedelta(seconds=30 * 2 ** job.attempts) if job.attempts < MAX_ATTEMPTS else None
+    EmbeddingJob.objects.bulk_update(jobs, ["attempts", "last_error", "retry_at"])
+
+
+def process_embedding_jobs(batch_size=EMBEDDING_BATCH_LIMIT, concurrency=4):
+    """
+    Embed the due jobs: up to `concurrency` batches of `batch_size` products, one API call each
+
+    Returns:
+        (embedded products, failed products), unchanged products count as neither
+    """
+    batch_size = min(batch_size, EMBEDDING_BATCH_LIMIT)
+    jobs = _claim(batch_size * concurrency)
+    if not jobs:
+        return 0, 0
+
+    # Deleted products lose their job with them, jobs of products gone since are dropped here
+    products = Product.objects.in_bulk([job.product_id for job in jobs])
+    gone = [job.pk for job in jobs if job.product_id not in products]
+    if gone:
+        EmbeddingJob.objects.filter(pk__in=gone).delete()
+    jobs = [job for job in jobs if job.product_id in products]
+    texts = {job.product_id: product_text(products[job.product_id]) for job in jobs}
+
+    # Same text and model as the stored embedding: nothing to compute
+    stored = dict(
+        ProductEmbedding.objects.filter(product_id__in=list(texts), model=settings.EMBEDDING_MODEL)
+        .values_list("product_id", "content_hash")
+    )
+    unchanged = [job for job in jobs if stored.get(job.product_id) == text_hash(texts[job.product_id])]
+    if unchanged:
+        _finish(unchanged)
+        count("skipped_unchanged", len(unchanged))
+    skipped = {job.pk for job in unchanged}
+    jobs = [job for job in jobs if job.pk not in skipped]
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+
+    # Only the API calls run in threads, the database is written from this one
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(
+            lambda batch: _embed_batch([texts[job.product_id] for job in batch]), batches
+        )
+        embedded = failed = 0
+        for batch, (vectors, error) in zip(batches, results):
+            count("embedded", len(batch))
+            if vectors is None:
+                logger.warning(f"Embedding batch of {len(batch)} products failed: {error}")
+                _retry(batch, error)
+                failed += len(batch)
+            else:
+                _save(
+                    batch,
+                    [products[job.product_id] for job in batch],
+                    [texts[job.product_id] for job in batch],
+                    vectors,
+                )
+                embedded += len(batch)
+    return embedded, failed
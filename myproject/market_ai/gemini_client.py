@@ -14,6 +14,7 @@ DEFAULT_EMBEDDING_MODEL = "text-embedding-004"
 DEFAULT_MAX_TOKENS = 2048
 DEFAULT_TEMPERATURE = 0.7
 MAX_RETRY_ATTEMPTS = 3
+EMBEDDING_BATCH_LIMIT = 100  # Texts per embed_content request
 
 
 class AIClientError(Exception):
@@ -227,6 +228,45 @@ def embed_text(
         return None
 
 
+def embed_texts(
+    texts: List[str],
+    model: str = DEFAULT_EMBEDDING_MODEL,
+    task_type: str = "RETRIEVAL_DOCUMENT"
+) -> List[List[float]]:
+    """
+    Generate the embeddings of several texts with a single embed_content call
+    
+    Args:
+        texts: Texts to embed (at most EMBEDDING_BATCH_LIMIT)
+        model: Embedding model name
+        task_type: Type of embedding task (RETRIEVAL_DOCUMENT, RETRIEVAL_QUERY, etc.)
+    
+    Returns:
+        One list of embedding values per text, in the same order
+    
+    Raises:
+        AIClientError: If the request fails or doesn't return one embedding per text
+    """
+    if not texts:
+        return []
+    client = get_client()
+    
+    try:
+        logger.debug(f"Generating {len(texts)} embeddings in one request")
+        response = client.models.embed_content(
+            model=model,
+            contents=texts,
+            config=types.EmbedContentConfig(task_type=task_type)
+        )
+    except Exception as e:
+        raise AIClientError(f"Embedding request failed: {e}") from e
+    
+    embeddings = getattr(response, 'embeddings', None) or []
+    if len(embeddings) != len(texts):
+        raise AIClientError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+    return [list(embedding.values) for embedding in embeddings]
+
+
 @lru_cache(maxsize=100)
 def generate_text_cached(prompt: str, model: str = DEFAULT_MODEL) -> str:
     """
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from market_ai.ann import IVFIndex, NPROBE
+from market_ai.vectors import DTYPE
+
+
+class Command(BaseCommand):
+    help = (
+        "Similar products index micro-benchmark on synthetic clustered vectors (no database): "
+        "build time, top-k latency and recall against exact search, insert/delete and save/load"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200_000)
+        parser.add_argument("--dimensions", type=int, default=768)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--nlist", type=int, default=None)
+        parser.add_argument("--nprobe", type=int, default=NPROBE)
+        parser.add_argument("--min-recall", type=float, default=None, help="Fail below this recall@k")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        n, d, k = options["products"], options["dimensions"], options["k"]
+        # Catalogs cluster by kind of product, uniform random vectors would be a worst case
+        centers = rng.standard_normal((max(1, n // 200), d)).astype(DTYPE)
+        vectors = centers[rng.integers(len(centers), size=n)]
+        vectors += 1.0 * rng.standard_normal((n, d)).astype(DTYPE)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = np.arange(1, n + 1)
+
+        start = time.perf_counter()
+        index = IVFIndex.from_vectors(ids, vectors, options["nlist"], model="bench")
+        self.stdout.write(
+            f"Built {n} x {d} in {len(index.centroids)} lists: {time.perf_counter() - start:.2f}s"
+        )
+
+        queries = rng.choice(n, options["queries"], replace=False)
+        latencies, recall = [], 0
+        for row in queries:
+            start = time.perf_counter()
+            hits = index.search(vectors[row], k, nprobe=options["nprobe"])
+            latencies.append(time.perf_counter() - start)
+            exact = ids[np.argpartition(-(vectors @ vectors[row]), k)[:k]]
+            recall += len({pk for pk, score in hits} & set(exact.tolist())) / k
+        recall /= len(queries)
+        latencies = np.array(latencies) * 1000
+        self.stdout.write(
+            f"top-{k}, nprobe {options['nprobe']}: {latencies.mean():.2f} ms mean, "
+            f"{np.percentile(latencies, 95):.2f} ms p95, recall {recall:.3f}"
+        )
+        start = time.perf_counter()
+        exact = vectors @ vectors[queries[0]]
+        np.argpartition(-exact, k)[:k]
+        self.stdout.write(f"Exact search over the whole matrix: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        for pk in ids[:1000]:
+            index.delete(int(pk))
+        for pk in ids[:1000]:
+            index.add(int(pk), vectors[pk - 1])
+        self.stdout.write(f"1000 deletes + 1000 inserts: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            start = time.perf_counter()
+            index.save(path)
+            saved = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = IVFIndex.load(path, model="bench")
+            self.stdout.write(f"Save {saved:.2f}s, load {time.perf_counter() - start:.2f}s")
+        if len(loaded) != n or loaded.search(vectors[queries[0]], k) != index.search(vectors[queries[0]], k):
+            raise CommandError("The loaded index doesn't match the saved one")
+
+        if options["min_recall"] is not None and recall < options["min_recall"]:
+            raise CommandError(f"Recall {recall:.3f} below {options['min_recall']}")
@@ -0,0 +1,42 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from market_ai.ann import IVFIndex, REBUILD_GROWTH
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the similar products index up to date and save it to EMBEDDING_INDEX_PATH, "
+        "so web workers load it instead of building it (run it periodically, or keep it running "
+        "with --every). The index is retrained once it grows past its trained size"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Retrain from scratch")
+        parser.add_argument("--nlist", type=int, default=None, help="Inverted lists (default ~2*sqrt(products))")
+        parser.add_argument(
+            "--every", type=float, default=None,
+            help="Keep running and save the index every this many seconds",
+        )
+
+    def handle(self, *args, **options):
+        path = settings.EMBEDDING_INDEX_PATH
+        index = None if options["rebuild"] else IVFIndex.load(path)
+        while True:
+            start = time.perf_counter()
+            if index is not None:
+                read = index.refresh()
+            if index is None or len(index) > REBUILD_GROWTH * max(index.trained_size, 1):
+                index = IVFIndex.build(nlist=options["nlist"])
+                read = len(index) if index is not None else 0
+            if index is None:
+                self.stdout.write("No embeddings to index")
+            else:
+                index.save(path)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{len(index)} product(s) in {len(index.centroids)} lists, {read} read, "
+                    f"saved to {path} in {time.perf_counter() - start:.2f}s"
+                ))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
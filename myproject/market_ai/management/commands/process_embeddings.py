@@ -0,0 +1,60 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from market.models import Product
+from market_ai.embeddings import STATS, embedding_stats, enqueue_products, process_embedding_jobs
+from market_ai.gemini_client import EMBEDDING_BATCH_LIMIT
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the queued product embeddings in batches, one embedding API call per batch "
+        "(run it periodically, or keep it running with --every)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_LIMIT, help="Products per API call")
+        parser.add_argument("--concurrency", type=int, default=4, help="API calls in flight at most")
+        parser.add_argument(
+            "--enqueue-missing", action="store_true",
+            help=(
+                "First queue every product without an embedding (e.g. bulk-created ones) "
+                "or embedded with a model other than EMBEDDING_MODEL"
+            ),
+        )
+        parser.add_argument("--stats", action="store_true", help="Print the embedding counters and exit")
+        parser.add_argument(
+            "--every", type=float, default=None,
+            help="Keep running and poll the queue every this many seconds instead of draining it once",
+        )
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            for name, value in embedding_stats().items():
+                self.stdout.write(f"{STATS[name]:<55} {value:>8}")
+            return
+
+        if options["enqueue_missing"]:
+            ids = list(
+                Product.objects.filter(~Q(embedding__model=settings.EMBEDDING_MODEL) | Q(embedding__isnull=True))
+                .values_list("pk", flat=True)
+            )
+            for start in range(0, len(ids), 1000):
+                enqueue_products(ids[start:start + 1000])
+            self.stdout.write(f"{len(ids)} product(s) without an up to date embedding queued")
+
+        while True:
+            embedded = failed = 0
+            while True:
+                done, errors = process_embedding_jobs(options["batch_size"], options["concurrency"])
+                embedded += done
+                failed += errors
+                # Failed jobs are rescheduled with backoff, so this stops once nothing is due
+                if not done:
+                    break
+            if embedded or failed or not options["every"]:
+                self.stdout.write(self.style.SUCCESS(f"{embedded} product(s) embedded, {failed} to retry"))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
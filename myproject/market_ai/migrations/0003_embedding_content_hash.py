@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_ai', '0002_embedding_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productembedding',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
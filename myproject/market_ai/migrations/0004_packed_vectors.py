@@ -0,0 +1,68 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:41
+
+import numpy as np
+from django.db import migrations, models
+
+
+def pack_vectors(apps, schema_editor):
+    # JSON lists of floats -> packed little-endian float32
+    ProductEmbedding = apps.get_model('market_ai', 'ProductEmbedding')
+    embeddings = []
+    for embedding in ProductEmbedding.objects.only('id', 'vector').iterator(1000):
+        embedding.packed = np.asarray(embedding.vector, dtype='<f4').tobytes()
+        embeddings.append(embedding)
+        if len(embeddings) == 1000:
+            ProductEmbedding.objects.bulk_update(embeddings, ['packed'])
+            embeddings = []
+    ProductEmbedding.objects.bulk_update(embeddings, ['packed'])
+
+
+def unpack_vectors(apps, schema_editor):
+    ProductEmbedding = apps.get_model('market_ai', 'ProductEmbedding')
+    embeddings = []
+    for embedding in ProductEmbedding.objects.only('id', 'packed').iterator(1000):
+        embedding.vector = np.frombuffer(embedding.packed, dtype='<f4').tolist()
+        embeddings.append(embedding)
+        if len(embeddings) == 1000:
+            ProductEmbedding.objects.bulk_update(embeddings, ['vector'])
+            embeddings = []
+    ProductEmbedding.objects.bulk_update(embeddings, ['vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_ai', '0003_embedding_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productembedding',
+            name='packed',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='productembedding',
+            name='vector',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(pack_vectors, unpack_vectors),
+        migrations.RemoveField(
+            model_name='productembedding',
+            name='vector',
+        ),
+        migrations.RenameField(
+            model_name='productembedding',
+            old_name='packed',
+            new_name='vector',
+        ),
+        migrations.AlterField(
+            model_name='productembedding',
+            name='vector',
+            field=models.BinaryField(),
+        ),
+        migrations.AddIndex(
+            model_name='productembedding',
+            index=models.Index(fields=['updated_at'], name='embedding_updated_idx'),
+        ),
+    ]
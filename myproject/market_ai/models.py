@@ -5,8 +5,38 @@ class ProductEmbedding(models.Model):
     # Use string to avoid circular imports inn product
     product = models.OneToOneField('market.Product', on_delete=models.CASCADE, related_name="embedding",)
     model = models.CharField(max_length=100, default="gemini-embedding-001")
-    vector = models.JSONField()  # Save the list of floats
+    # Packed float32 values, see market_ai.vectors
+    vector = models.BinaryField()
+    # sha256 of the embedded text, re-embedding is skipped while it and the model don't change
+    content_hash = models.CharField(max_length=64, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Incremental refresh of the in-memory matrix
+            models.Index(fields=["updated_at"], name="embedding_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"Embedding {self.product_id} ({self.model})"
+
+class EmbeddingJob(models.Model):
+    """
+    Durable queue of products whose embedding has to be (re)computed, one row per product.
+    Saving a product only upserts its row; `manage.py process_embeddings` embeds them in batches
+    """
+    product = models.OneToOneField('market.Product', on_delete=models.CASCADE, related_name="+")
+    # Bumped on every new request, so a save during processing isn't lost
+    requested_at = models.DateTimeField()
+    # Picked by the worker from then on, null once it gave up
+    retry_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["retry_at"], condition=models.Q(retry_at__isnull=False), name="embeddingjob_pending_idx"),
+        ]
+
     def __str__(self):
-        return f"Embedding {self.product_id} ({self.model})"
\ No newline at end of file
+        return f"Embedding job {self.product_id}"
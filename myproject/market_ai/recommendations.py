@@ -0,0 +1,32 @@
+from market.models import Product
+from market.utils import in_stock_q
+from .ann import NPROBE, similar_products_index
+
+# Candidates fetched from the index per recommendation, the filters drop some of them
+OVERFETCH = 4
+
+
+def recommend_similar(product, user, k=12):
+    """
+    Up to k active, in-stock products of other sellers closest to product, best first
+
+    The index is queried for k * OVERFETCH candidates and the filters run on them in one
+    query; if too few pass, the search is widened a couple of times.
+    """
+    index = similar_products_index()
+    vector = index.vector(product.pk) if index is not None else None
+    if vector is None:
+        return []
+    products = Product.objects.filter(in_stock_q(), active=True).exclude(seller_id=product.seller_id)
+    if user.is_authenticated:
+        products = products.exclude(seller=user)
+
+    fetch, nprobe = k * OVERFETCH, NPROBE
+    for _ in range(3):
+        hits = index.search(vector, fetch, nprobe=nprobe, exclude=(product.pk,))
+        found = products.in_bulk([product_id for product_id, score in hits])
+        recommended = [found[product_id] for product_id, score in hits if product_id in found]
+        if len(recommended) >= k or len(hits) < fetch:
+            break
+        fetch, nprobe = fetch * OVERFETCH, nprobe * OVERFETCH
+    return recommended[:k]
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from market.search import HotPrefixCache, search_products
+from .ann import similar_products_index
+from .embeddings import count
+from .gemini_client import AIClientError, embed_text
+from .vectors import normalize, pack_vector, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+# Query embeddings are memoized in the shared cache (evicted by the backend, LRU on Redis)
+# and in a small per-process LRU in front of it, so a popular query is embedded only once.
+QUERY_PREFIX = "market_ai:query_embedding"
+# Seconds other workers wait for a query being embedded instead of embedding it too
+QUERY_LOCK_TIMEOUT = 5
+
+# Candidates taken from the vector index and from the keyword index before ranking
+SEMANTIC_CANDIDATES = 200
+
+query_vector_cache = HotPrefixCache(maxsize=256, timeout=settings.QUERY_EMBEDDING_CACHE_TIMEOUT)
+
+
+def query_embedding(query):
+    """Embedding of a search query, None if it can't be computed right now"""
+    text = " ".join(query.lower().split())
+    if not text:
+        return None
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    key = f"{QUERY_PREFIX}:{settings.EMBEDDING_MODEL}:{digest}"
+
+    vector = query_vector_cache.get(key)
+    if vector is not None:
+        count("query_cached")
+        return vector
+    data = cache.get(key)
+    if data is None and not cache.add(f"{key}:lock", 1, QUERY_LOCK_TIMEOUT):
+        # Another worker is embedding the same query
+        deadline = time.monotonic() + QUERY_LOCK_TIMEOUT
+        while data is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            data = cache.get(key)
+    if data is not None:
+        count("query_cached")
+    else:
+        try:
+            values = embed_text(text, model=settings.EMBEDDING_MODEL, task_type="RETRIEVAL_QUERY")
+        except AIClientError as e:
+            # No API key or client: the caller falls back to keyword search
+            logger.warning(f"Search query not embedded: {e}")
+            values = None
+        finally:
+            # Released even on errors, other workers would wait for it otherwise
+            cache.delete(f"{key}:lock")
+        if values is None:
+            return None
+        count("query_embedded")
+        data = pack_vector(values)
+        cache.set(key, data, settings.QUERY_EMBEDDING_CACHE_TIMEOUT)
+    vector = unpack_vector(data)
+    query_vector_cache.set(key, vector)
+    return vector
+
+
+def semantic_search(products, query, limit, keyword_weight=None):
+    """
+    Products of the queryset closest in meaning to query, best first
+
+    Similarity is the cosine between the query and product embeddings, blended with the
+    keyword relevance (scaled to 0-1) by keyword_weight (SEMANTIC_KEYWORD_WEIGHT by default,
+    0 ranks by similarity only).
+
+    Returns:
+        Up to limit products, or None when the query can't be embedded or nothing is indexed
+    """
+    if keyword_weight is None:
+        keyword_weight = settings.SEMANTIC_KEYWORD_WEIGHT
+    # Nothing indexed yet: don't spend an API call on the query
+    index = similar_products_index()
+    if index is None:
+        return None
+    vector = query_embedding(query)
+    if vector is None:
+        return None
+    vector = normalize(vector)
+
+    candidates = max(SEMANTIC_CANDIDATES, limit * 4)
+    similarity = dict(index.search(vector, candidates))
+    keyword = {}
+    if keyword_weight:
+        ranks = dict(
+            search_products(products, query).order_by("-search_rank")
+            .values_list("pk", "search_rank")[:candidates]
+        )
+        best = max(ranks.values(), default=0) or 1
+        keyword = {pk: max(rank or 0, 0) / best for pk, rank in ranks.items()}
+        # Keyword matches the vector search didn't reach still get their similarity
+        for pk in keyword.keys() - similarity.keys():
+            product_vector = index.vector(pk)
+            similarity[pk] = float(product_vector @ vector) if product_vector is not None else 0.0
+
+    scores = {
+        pk: (1 - keyword_weight) * score + keyword_weight * keyword.get(pk, 0.0)
+        for pk, score in similarity.items()
+    }
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    found = products.in_bulk(ranked)
+    return [found[pk] for pk in ranked if pk in found][:limit]
@@ -1,16 +1,21 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from market.models import Product
+from .embeddings import EMBEDDED_FIELDS, enqueue_products, count
 from .models import ProductEmbedding
-from .gemini_client import embed_text
+from .vectors import embeddings_deleted
 
 @receiver(post_save, sender=Product)
-def compute_product_embedding(sender, instance, created, **kwargs):
-    # Update or create embedding (might take a while)
-    text = f"{instance.title}. {instance.description or ''}. Marca: {instance.brand or ''}"
-    emb = embed_text(text)
-    if emb:
-        obj, _ = ProductEmbedding.objects.update_or_create(
-            product=instance,
-            defaults={"vector": emb}
-        )
\ No newline at end of file
+def enqueue_product_embedding(sender, instance, created, update_fields=None, **kwargs):
+    # Saves that only touch stock/active/etc. don't change the embedded text
+    if update_fields is not None and not set(update_fields) & set(EMBEDDED_FIELDS):
+        count("skipped_save")
+        return
+    # Only queues the product, the embedding API is called by `manage.py process_embeddings`
+    enqueue_products([instance.pk])
+
+
+@receiver(post_delete, sender=ProductEmbedding)
+def drop_deleted_embedding(sender, instance, **kwargs):
+    # Tells the in-memory matrices to drop the rows that are gone on their next refresh
+    embeddings_deleted()
@@ -5,4 +5,5 @@ app_name = "market_ai"
 
 urlpatterns = [
     path("chat/", views.ai_chat, name="ai_chat"),
+    path("products/<int:pk>/similar/", views.similar_products, name="similar_products"),
 ]
\ No newline at end of file
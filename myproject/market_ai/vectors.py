@@ -0,0 +1,123 @@
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from .models import ProductEmbedding
+
+# Vectors are stored as packed little-endian float32, 4 bytes per dimension
+DTYPE = np.dtype("<f4")
+
+# refresh() looks at rows updated since the previous one minus this margin, so rows saved
+# by transactions that committed late aren't missed
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+# Seconds the process-wide index goes without checking the database
+REFRESH_INTERVAL = 5
+
+# Bumped whenever embeddings are deleted, refresh() then drops the rows that are gone
+DELETES_KEY = "market_ai:embedding_deletes"
+
+
+def pack_vector(values):
+    """Embedding values as the bytes stored in ProductEmbedding.vector"""
+    return np.asarray(values, dtype=DTYPE).tobytes()
+
+
+def unpack_vector(data):
+    """Read-only float32 array over the stored bytes, no copy"""
+    return np.frombuffer(data, dtype=DTYPE)
+
+
+def normalize(vector):
+    """vector scaled to unit length, zero vectors are left as they are"""
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def embeddings_deleted():
+    if not cache.add(DELETES_KEY, 1, timeout=None):
+        try:
+            cache.incr(DELETES_KEY)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(DELETES_KEY, 1, timeout=None)
+
+
+class SyncedEmbeddings:
+    """
+    In-memory copy of the ProductEmbedding vectors of one model, kept in sync by refresh().
+
+    refresh() only reads the vectors updated since the previous refresh, subclasses store them
+    in _put() and drop them in _remove(), under self._lock.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or settings.EMBEDDING_MODEL
+        self._lock = threading.Lock()
+        self._stamps = {}  # product id -> updated_at of its row
+        self._since = None
+        self._deletes = None
+        self.refreshed = None  # time.monotonic() of the last refresh
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def __contains__(self, product_id):
+        return product_id in self._stamps
+
+    def _put(self, product_id, vector):
+        raise NotImplementedError
+
+    def _remove(self, product_id):
+        raise NotImplementedError
+
+    def _discard(self, product_id):
+        if self._stamps.pop(product_id, None) is not None:
+            self._remove(product_id)
+
+    def refresh(self):
+        """
+        Apply the embeddings saved or deleted since the last refresh
+
+        Returns:
+            Number of vectors read from the database
+        """
+        with self._lock:
+            self.refreshed = time.monotonic()
+            deletes = cache.get(DELETES_KEY, 0)
+            # Also right after loading a saved copy, which may have missed deletions
+            if self._since is not None and deletes != self._deletes:
+                current = set(
+                    ProductEmbedding.objects.filter(model=self.model).values_list("product_id", flat=True)
+                )
+                for product_id in [pk for pk in self._stamps if pk not in current]:
+                    self._discard(product_id)
+            self._deletes = deletes
+
+            if self._since is None:
+                rows = ProductEmbedding.objects.filter(model=self.model)
+            else:
+                # Only (id, stamp) pairs for the window, vectors are read for the changed rows
+                window = ProductEmbedding.objects.filter(updated_at__gte=self._since - REFRESH_OVERLAP)
+                changed = [
+                    product_id for product_id, updated_at in window.values_list("product_id", "updated_at")
+                    if self._stamps.get(product_id) != updated_at
+                ]
+                if not changed:
+                    return 0
+                rows = ProductEmbedding.objects.filter(product_id__in=changed)
+            read = 0
+            fields = ("product_id", "model", "vector", "updated_at")
+            for product_id, model, data, updated_at in rows.values_list(*fields).iterator(2000):
+                read += 1
+                if model == self.model:
+                    if self._put(product_id, unpack_vector(data)) is not False:
+                        self._stamps[product_id] = updated_at
+                else:
+                    # Re-embedded with another model, not comparable anymore
+                    self._discard(product_id)
+                if self._since is None or updated_at > self._since:
+                    self._since = updated_at
+            return read
@@ -1,10 +1,13 @@
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.contrib import messages
 from .forms import ChatForm
 from .gemini_client import generate_text
 import json
 from .gemini_client import generate_chat_response
+from .recommendations import recommend_similar
+from market.models import Product
+from market.utils import attach_favorite_flags
 
 @login_required
 def ai_chat(request):
@@ -152,4 +155,11 @@ def ai_chat(request):
         "form": form, 
         "history": history,
         "message_count": len(history)
-    })
\ No newline at end of file
+    })
+
+
+def similar_products(request, pk):
+    """Products similar to the given one, by embedding"""
+    product = get_object_or_404(Product, pk=pk, active=True)
+    recommended = attach_favorite_flags(recommend_similar(product, request.user), request.user)
+    return render(request, "recommendations.html", {"product": product, "recommended": recommended})
@@ -49,6 +49,7 @@ OWN_APPS = [
     "market",
     "profiles",
     "market_ai",
+    "receipts",
 ]
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + OWN_APPS
@@ -75,6 +76,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'market.anonymous_cart.AnonymousCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware", # <-- Allauth requirement
@@ -96,6 +98,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'market.context_processors.navbar',
             ],
         },
     },
@@ -112,6 +115,12 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Take the write lock when a transaction starts, so concurrent cart updates
+            # wait for each other instead of failing with "database is locked"
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
         }
     }
 
@@ -136,6 +145,59 @@ SOCIALACCOUNT_PROVIDERS = {
 SOCIALACCOUNT_LOGIN_ON_GET = True
 
 
+# Cache, shared between workers: CACHE_URL=redis://... or memcache://...
+# Invalidations (storefront, navbar, holds) only reach the worker that makes them with a
+# per-process cache, so locmem is only allowed in development
+if DEBUG==False:
+     CACHES = {"default": env.cache("CACHE_URL")}
+else:
+     CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# Seconds an anonymous storefront page stays cached (it's also invalidated on product changes)
+STOREFRONT_CACHE_TIMEOUT = env.int("STOREFRONT_CACHE_TIMEOUT", default=300)
+# Same for semantic search pages, which also change when embeddings are recomputed
+SEMANTIC_CACHE_TIMEOUT = env.int("SEMANTIC_CACHE_TIMEOUT", default=60)
+
+# Seconds the category counts of a search stay cached (only expire, they aren't invalidated)
+FACETS_CACHE_TIMEOUT = env.int("FACETS_CACHE_TIMEOUT", default=60)
+
+# Seconds a cart item keeps its units reserved since the last time it was touched
+CART_HOLD_TTL = env.int("CART_HOLD_TTL", default=15 * 60)
+
+# Seconds the cart of a visitor that isn't logged in is kept in their browser
+ANONYMOUS_CART_MAX_AGE = env.int("ANONYMOUS_CART_MAX_AGE", default=14 * 24 * 60 * 60)
+
+# Seconds the header counters (cart, wishlist, avatar) of a user are cached
+NAVBAR_CACHE_TIMEOUT = env.int("NAVBAR_CACHE_TIMEOUT", default=600)
+
+# Mercado Pago credentials, MERCADOPAGO_API_URL can point at `manage.py fake_mercadopago` for load tests
+MERCADOPAGO_ACCESS_TOKEN = env("MERCADOPAGO_ACCESS_TOKEN", default="")
+MERCADOPAGO_API_URL = env("MERCADOPAGO_API_URL", default="https://api.mercadopago.com")
+# Secret of the webhook configured in Mercado Pago, notifications without a valid signature are refused
+MERCADOPAGO_WEBHOOK_SECRET = env("MERCADOPAGO_WEBHOOK_SECRET", default="")
+# Seconds a checkout preference is reused while the cart doesn't change
+MERCADOPAGO_PREFERENCE_CACHE_TIMEOUT = env.int("MERCADOPAGO_PREFERENCE_CACHE_TIMEOUT", default=30 * 60)
+
+# Model of the product embeddings, changing it re-embeds the products as their jobs run
+# (`manage.py process_embeddings --enqueue-missing` queues all of them)
+EMBEDDING_MODEL = env("EMBEDDING_MODEL", default="text-embedding-004")
+
+# Similar products index, saved by `manage.py build_embedding_index` and loaded by every worker
+# (again each time the command rewrites it, nothing is served until it has run once)
+EMBEDDING_INDEX_PATH = env("EMBEDDING_INDEX_PATH", default=str(BASE_DIR / "var" / "embedding_index.npz"))
+
+# Seconds a search query embedding stays cached, and weight of the keyword relevance in
+# semantic search results (0 ranks by meaning only)
+QUERY_EMBEDDING_CACHE_TIMEOUT = env.int("QUERY_EMBEDDING_CACHE_TIMEOUT", default=7 * 24 * 60 * 60)
+SEMANTIC_KEYWORD_WEIGHT = env.float("SEMANTIC_KEYWORD_WEIGHT", default=0.3)
+
+# Seconds a rendered receipt PDF is kept (cart changes give a new key, nothing is invalidated)
+RECEIPT_CACHE_TIMEOUT = env.int("RECEIPT_CACHE_TIMEOUT", default=60 * 60)
+
+# Seconds search suggestions are kept in memory by each process and by browsers
+SUGGEST_CACHE_TIMEOUT = env.int("SUGGEST_CACHE_TIMEOUT", default=60)
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -1,6 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from market.cache import invalidate_navbar
 from .models import Profile
 
 @receiver(post_save, sender=User)
@@ -17,3 +18,8 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         else:
             instance.profile.save()
 
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_avatar(sender, instance, **kwargs):
+    # The avatar is cached with the header counters
+    invalidate_navbar(instance.user_id)
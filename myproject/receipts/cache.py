@@ -0,0 +1,25 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+
+# Rendered receipts are cached under a hash of everything printed on them, which is
+# also their ETag. A cart change gives a new hash, so there is nothing to invalidate:
+# the old PDF is never looked up again and expires. Bump RECEIPT_VERSION when the
+# layout changes.
+RECEIPT_PREFIX = "receipts:pdf"
+RECEIPT_VERSION = 2
+
+
+def receipt_etag(*parts):
+    """Strong ETag (quoted) for a receipt printing parts"""
+    payload = json.dumps([RECEIPT_VERSION, *parts], default=str, separators=(",", ":"))
+    return f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+
+
+def get_receipt(etag):
+    return cache.get(f"{RECEIPT_PREFIX}:{etag.strip(chr(34))}")
+
+
+def set_receipt(etag, pdf):
+    cache.set(f"{RECEIPT_PREFIX}:{etag.strip(chr(34))}", pdf, settings.RECEIPT_CACHE_TIMEOUT)
@@ -0,0 +1,88 @@
+import time
+import tracemalloc
+from decimal import Decimal
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.utils.timezone import localtime
+from receipts.utils import cart_receipt, render_receipt
+from ._baseline_receipt import generate_cart_receipt
+
+
+class Command(BaseCommand):
+    help = (
+        "Receipt rendering micro-benchmark: renders per second and peak memory of the render engine "
+        "against the cart receipt code it replaced, on the same cart"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--renders", type=int, default=200)
+        parser.add_argument("--lines", type=int, default=10, help="Item rows per receipt")
+        parser.add_argument(
+            "--min-renders", type=float, default=None,
+            help="Fail if the engine renders fewer receipts per second than this",
+        )
+
+    def handle(self, *args, **options):
+        user = SimpleNamespace(username="benchmark", email="bench@example.com")
+        items = [
+            _Item(f"Producto de prueba {i}", Decimal("1999.90"), i % 3 + 1) for i in range(options["lines"])
+        ]
+        summary = _Summary(items)
+        # The baseline reads the Cart model: cart.items.all() and cart.total()
+        cart = SimpleNamespace(items=SimpleNamespace(all=lambda: items), total=lambda: summary.total)
+        date = localtime()
+
+        def engine():
+            response = HttpResponse(content_type="application/pdf")
+            render_receipt(cart_receipt(user, summary, date), response)
+            return response.content
+
+        def baseline():
+            return generate_cart_receipt(cart, user)
+
+        results = {}
+        for label, render in (("baseline", baseline), ("engine", engine)):
+            render()  # warm up fonts and imports
+            start = time.perf_counter()
+            for _ in range(options["renders"]):
+                size = len(render())
+            per_second = options["renders"] / (time.perf_counter() - start)
+
+            tracemalloc.start()
+            render()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[label] = per_second
+            self.stdout.write(
+                f"{label:<15} {per_second:8.1f} renders/s  peak {peak / 1024:8.1f} KiB  ({size} byte PDF)"
+            )
+
+        speedup = results["engine"] / results["baseline"]
+        self.stdout.write(f"Engine speedup: x{speedup:.2f}")
+        if options["min_renders"] is not None and results["engine"] < options["min_renders"]:
+            raise CommandError(
+                f"Engine renders {results['engine']:.1f} receipts/s (minimum {options['min_renders']})"
+            )
+
+
+
+class _Item:
+    """Cart item with both the CartItem.subtotal() the baseline calls and the CartSummary fields"""
+
+    def __init__(self, title, price, quantity):
+        self.product = SimpleNamespace(title=title, price=price)
+        self.quantity = quantity
+        self.line_subtotal = price * quantity
+
+    def subtotal(self):
+        return self.line_subtotal
+
+
+class _Summary(list):
+    """Stand-in for a CartSummary: its items plus the total"""
+
+    def __init__(self, items):
+        super().__init__(items)
+        self.total = sum(item.line_subtotal for item in items)
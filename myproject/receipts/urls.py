@@ -5,4 +5,5 @@ app_name = 'receipts'
 
 urlpatterns = [
     path('products/cart/download/', views.download_cart_receipt, name='download_cart_receipt'),
+    path('products/orders/<int:pk>/receipt/', views.download_order_receipt, name='download_order_receipt'),
 ]
\ No newline at end of file
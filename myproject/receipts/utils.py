@@ -1,21 +1,24 @@
+from collections import namedtuple
+from functools import lru_cache
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.enums import TA_CENTER
-from io import BytesIO
-from datetime import datetime
-
-def generate_cart_receipt(cart, user):
-    """Generate a PDF receipt for the shopping cart"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for elements
-    elements = []
+from django.utils.timezone import localtime
+
+# What a receipt prints, rows are (title, unit price, quantity, subtotal) tuples
+Receipt = namedtuple("Receipt", "title username email date_text rows total footer empty_text")
+
+ReceiptStyles = namedtuple("ReceiptStyles", "normal title header footer table col_widths")
+
+
+@lru_cache(maxsize=1)
+def receipt_styles():
+    """Paragraph and table styles of the receipts, built once per process"""
     styles = getSampleStyleSheet()
-    
+
     # Custom styles
     title_style = ParagraphStyle(
         'CustomTitle',
@@ -25,7 +28,7 @@ def generate_cart_receipt(cart, user):
         spaceAfter=30,
         alignment=TA_CENTER
     )
-    
+
     header_style = ParagraphStyle(
         'CustomHeader',
         parent=styles['Normal'],
@@ -34,102 +37,128 @@ def generate_cart_receipt(cart, user):
         alignment=TA_CENTER,
         spaceAfter=20
     )
-    
+
+    footer_style = ParagraphStyle(
+        'Footer',
+        parent=styles['Normal'],
+        fontSize=9,
+        textColor=colors.grey,
+        alignment=TA_CENTER
+    )
+
+    # Negative indexes are resolved per table, so one TableStyle serves every receipt
+    table_style = TableStyle([
+        # Header row
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#34495e')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+
+        # Data rows
+        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -2), 10),
+        ('TOPPADDING', (0, 1), (-1, -2), 6),
+        ('BOTTOMPADDING', (0, 1), (-1, -2), 6),
+
+        # Total row
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#2ecc71')),
+        ('TEXTCOLOR', (0, -1), (-1, -1), colors.whitesmoke),
+        ('ALIGN', (0, -1), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+        ('TOPPADDING', (0, -1), (-1, -1), 12),
+        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
+
+        # Grid
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ])
+
+    return ReceiptStyles(
+        normal=styles['Normal'],
+        title=title_style,
+        header=header_style,
+        footer=footer_style,
+        table=table_style,
+        col_widths=[3.5*inch, 1.2*inch, 1*inch, 1.2*inch],
+    )
+
+
+def cart_receipt(user, cart_items, date):
+    """
+    Receipt of the shopping cart
+
+    Args:
+        cart_items: CartSummary of the cart
+        date: Printed as the day only, so the cached PDF stays valid all day (see receipts.cache)
+    """
+    footer_text = """
+        <b>Nota:</b> Este es un resumen informativo de tu carrito.<br/>
+        No constituye una factura ni un comprobante de compra.<br/>
+        Para completar tu compra, procede al pago en la plataforma.
+        """
+    return Receipt(
+        "Resumen de Carrito", user.username, user.email, date.strftime('%d/%m/%Y'),
+        [(item.product.title, item.product.price, item.quantity, item.line_subtotal) for item in cart_items],
+        cart_items.total, footer_text, "Tu carrito está vacío",
+    )
+
+
+def order_receipt(order, lines):
+    """Receipt of a paid order, only from its frozen snapshot"""
+    footer_text = f"""
+        <b>Comprobante de compra</b><br/>
+        Pedido N° {order.pk} - Pago Mercado Pago N° {order.payment_id}<br/>
+        Los precios son los vigentes al momento de la compra.
+        """
+    return Receipt(
+        "Comprobante de Compra", order.buyer_username, order.buyer_email,
+        localtime(order.paid_at).strftime('%d/%m/%Y %H:%M'),
+        [(line.title, line.unit_price, line.quantity, line.subtotal) for line in lines],
+        order.total, footer_text, "El pedido no tiene productos",
+    )
+
+
+def render_receipt(receipt, out):
+    """
+    Render a Receipt as PDF into out, any object with write() (e.g. the HttpResponse).
+    ReportLab writes the finished document in a single write() call
+    """
+    styles = receipt_styles()
+    doc = SimpleDocTemplate(out, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+
     # Title
-    title = Paragraph("Resumen de Carrito", title_style)
-    elements.append(title)
-    
+    elements = [Paragraph(receipt.title, styles.title)]
+
     # Header info
     header_text = f"""
     <b>Mi Mercado</b><br/>
-    Usuario: {user.username}<br/>
-    Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
-    Email: {user.email if user.email else 'No proporcionado'}
+    Usuario: {receipt.username}<br/>
+    Fecha: {receipt.date_text}<br/>
+    Email: {receipt.email if receipt.email else 'No proporcionado'}
     """
-    header = Paragraph(header_text, header_style)
-    elements.append(header)
+    elements.append(Paragraph(header_text, styles.header))
     elements.append(Spacer(1, 0.3*inch))
-    
-    # Cart items table
-    cart_items = cart.items.all()
-    
-    if cart_items:
-        # Table data
+
+    # Items table
+    if receipt.rows:
         data = [['Producto', 'Precio', 'Cantidad', 'Subtotal']]
-        
-        for item in cart_items:
-            data.append([
-                Paragraph(item.product.title[:40], styles['Normal']),
-                f'${item.product.price}',
-                str(item.quantity),
-                f'${item.subtotal()}'
-            ])
-        
-        # Add total row
-        data.append(['', '', 'TOTAL:', f'${cart.total()}'])
-        
-        # Create table
-        table = Table(data, colWidths=[3.5*inch, 1.2*inch, 1*inch, 1.2*inch])
-        table.setStyle(TableStyle([
-            # Header row
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#34495e')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            
-            # Data rows
-            ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -2), 10),
-            ('TOPPADDING', (0, 1), (-1, -2), 6),
-            ('BOTTOMPADDING', (0, 1), (-1, -2), 6),
-            
-            # Total row
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#2ecc71')),
-            ('TEXTCOLOR', (0, -1), (-1, -1), colors.whitesmoke),
-            ('ALIGN', (0, -1), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, -1), (-1, -1), 12),
-            ('TOPPADDING', (0, -1), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
-            
-            # Grid
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        
-        elements.append(table)
+        # Titles are cut to fit the column, plain strings skip the Paragraph markup parser
+        for title, price, quantity, subtotal in receipt.rows:
+            data.append([title[:40], f'${price}', str(quantity), f'${subtotal}'])
+        data.append(['', '', 'TOTAL:', f'${receipt.total}'])
+
+        elements.append(Table(data, colWidths=styles.col_widths, style=styles.table))
         elements.append(Spacer(1, 0.5*inch))
-        
+
         # Footer notes
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.grey,
-            alignment=TA_CENTER
-        )
-        
-        footer_text = """
-        <b>Nota:</b> Este es un resumen informativo de tu carrito.<br/>
-        No constituye una factura ni un comprobante de compra.<br/>
-        Para completar tu compra, procede al pago en la plataforma.
-        """
-        footer = Paragraph(footer_text, footer_style)
-        elements.append(footer)
+        elements.append(Paragraph(receipt.footer, styles.footer))
     else:
-        # Empty cart message
-        empty_msg = Paragraph("Tu carrito está vacío", styles['Normal'])
-        elements.append(empty_msg)
-    
-    # Build PDF
+        # Empty message
+        elements.append(Paragraph(receipt.empty_text, styles.normal))
+
     doc.build(elements)
-    
-    # Get PDF from buffer
-    pdf = buffer.getvalue()
-    buffer.close()
-    
-    return pdf
\ No newline at end of file
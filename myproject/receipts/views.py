@@ -1,18 +1,68 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404
-from market.models import Cart
-from .utils import generate_cart_receipt
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.timezone import localtime
+from market.models import Cart, Order
+from market.orders import order_with_lines
+from .cache import receipt_etag, get_receipt, set_receipt
+from .utils import cart_receipt, order_receipt, render_receipt
+
+def _pdf_response(request, etag, build, filename):
+    """
+    304 when the browser already has this receipt, otherwise the cached PDF or the
+    Receipt returned by build() rendered. Browsers revalidate on every download
+    (no-cache) with If-None-Match
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        pdf = get_receipt(etag)
+        if pdf is None:
+            # Nothing to stream: ReportLab writes the finished PDF in one write(), straight
+            # into the response, and the same bytes are cached
+            response = HttpResponse(content_type='application/pdf')
+            render_receipt(build(), response)
+            set_receipt(etag, response.content)
+        else:
+            response = HttpResponse(pdf, content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @login_required
 def download_cart_receipt(request):
     cart = get_object_or_404(Cart, user=request.user)
-    
-    # Generate PDF
-    pdf = generate_cart_receipt(cart, request.user)
-    
-    # Create HTTP response
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="carrito_{request.user.username}.pdf"'
-    
-    return response
\ No newline at end of file
+    cart_items = cart.summary()
+    date = localtime()
+
+    # Everything the receipt prints, the PDF is only rendered when one of them changes
+    etag = receipt_etag(
+        "cart",
+        request.user.username,
+        request.user.email,
+        date.strftime('%d/%m/%Y'),
+        [(item.product.title, item.product.price, item.quantity) for item in cart_items],
+        cart_items.total,
+    )
+    return _pdf_response(
+        request, etag,
+        lambda: cart_receipt(request.user, cart_items, date),
+        f"carrito_{request.user.username}.pdf",
+    )
+
+@login_required
+def download_order_receipt(request, pk):
+    # One query for the order and its lines, nothing is read from the live cart or products
+    try:
+        order, lines = order_with_lines(request.user, pk)
+    except Order.DoesNotExist:
+        raise Http404("Pedido no encontrado")
+
+    # Orders never change once written
+    etag = receipt_etag("order", order.pk, order.payment_id)
+    return _pdf_response(
+        request, etag,
+        lambda: order_receipt(order, lines),
+        f"pedido_{order.pk}.pdf",
+    )
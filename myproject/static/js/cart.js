@@ -1,49 +1,127 @@
+// Cart actions through the JSON cart API: only the changed lines and the totals come back
+const cartSetUrl = document.currentScript.dataset.setUrl;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Get CSRF token
-    const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+    const csrfInput = document.querySelector('[name=csrfmiddlewaretoken]');
+    if (!csrfInput) return;
+    const csrftoken = csrfInput.value;
+
+    function post(url, body, contentType) {
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': contentType || 'application/x-www-form-urlencoded',
+                'X-CSRFToken': csrftoken,
+                'X-Requested-With': 'XMLHttpRequest'
+            },
+            body: body
+        }).then(response => response.json());
+    }
+
+    // Header badge with the number of units in the cart
+    function updateBadge(data) {
+        document.querySelectorAll('.navbar-cart-count').forEach(badge => {
+            badge.textContent = data.cart_quantity;
+            badge.hidden = data.cart_quantity === 0;
+        });
+    }
+
+    // Apply the changed lines and the new totals to the cart page
+    function applyCart(data) {
+        updateBadge(data);
+        data.lines.forEach(line => {
+            const cartItem = document.querySelector(`.cart-item[data-product-id="${line.product_id}"]`);
+            if (!cartItem) return;
+
+            if (line.quantity === 0) {
+                cartItem.remove();
+                return;
+            }
+            cartItem.querySelector('.item-quantity').value = line.quantity;
+            cartItem.querySelector('.item-subtotal').textContent = `$${line.subtotal}`;
+            cartItem.querySelector('.decrease-btn').disabled = line.quantity <= 1;
+            cartItem.querySelector('.increase-btn').disabled = line.available < 1;
+            cartItem.querySelector('.out-of-stock').hidden = line.available >= 1;
+        });
+
+        // Last item removed: render the empty cart
+        if (data.cart_count === 0 && document.querySelector('.cart-item') === null) {
+            window.location.reload();
+            return;
+        }
+        const total = document.getElementById('cart-total');
+        if (total) {
+            total.textContent = `$${data.cart_total}`;
+            document.getElementById('cart-subtotal').textContent = `$${data.cart_total}`;
+            document.getElementById('cart-count').textContent = data.cart_count;
+        }
+    }
+
+    function handle(data) {
+        if (data.success) {
+            applyCart(data);
+        } else {
+            alert(data.message);
+        }
+        return data;
+    }
+
+    // Quantity update and remove buttons
+    document.querySelectorAll('.quantity-form, .remove-form').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            const action = this.querySelector('input[name="action"]');
+            post(this.action, action ? `action=${action.value}` : '')
+                .then(handle)
+                .catch(error => console.error('Error:', error));
+        });
+    });
+
+    // Typed quantities are sent together in one batch once typing stops
+    const pending = new Map();
+    let timer = null;
+    document.querySelectorAll('.cart-item .item-quantity').forEach(input => {
+        input.addEventListener('change', function() {
+            const productId = this.closest('.cart-item').dataset.productId;
+            const quantity = parseInt(this.value, 10);
+            if (isNaN(quantity) || quantity < 0) return;
+            pending.set(productId, quantity);
+
+            clearTimeout(timer);
+            timer = setTimeout(function() {
+                const items = Array.from(pending, ([product_id, quantity]) => ({ product_id, quantity }));
+                pending.clear();
+                post(cartSetUrl, JSON.stringify({ items: items }), 'application/json')
+                    .then(data => {
+                        handle(data);
+                        // Rejected batches leave the cart as it was
+                        if (!data.success) window.location.reload();
+                    })
+                    .catch(error => console.error('Error:', error));
+            }, 400);
+        });
+    });
 
-    // Quantity update buttons
-    document.querySelectorAll('.quantity-form').forEach(form => {
+    // Add to cart from the listings without leaving the page
+    document.querySelectorAll('.add-to-cart-form').forEach(form => {
         form.addEventListener('submit', function(e) {
             e.preventDefault();
-            
-            const productId = this.dataset.productId;
-            const action = this.querySelector('input[name="action"]').value;
-            const cartItem = document.querySelector(`.cart-item[data-product-id="${productId}"]`);
-            
-            fetch(this.action, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'X-CSRFToken': csrftoken,
-                    'X-Requested-With': 'XMLHttpRequest'
-                },
-                body: `action=${action}`
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Update quantity display
-                    cartItem.querySelector('.item-quantity').textContent = data.quantity;
-                    
-                    // Update subtotal
-                    cartItem.querySelector('.item-subtotal').textContent = `$${data.subtotal}`;
-                    
-                    // Update cart total
-                    document.getElementById('cart-total').textContent = `$${data.cart_total}`;
-                    document.getElementById('cart-subtotal').textContent = `$${data.cart_total}`;
-                    
-                    // Update button states
-                    const decreaseBtn = cartItem.querySelector('.decrease-btn');
-                    const increaseBtn = cartItem.querySelector('.increase-btn');
-                    
-                    decreaseBtn.disabled = data.quantity <= 1;
-                    increaseBtn.disabled = data.quantity >= data.stock;
-                } else {
-                    alert(data.message);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+            const button = this.querySelector('button[type="submit"]');
+            const quantity = this.querySelector('input[name="quantity"]');
+            post(this.action, `quantity=${encodeURIComponent(quantity.value)}`)
+                .then(data => {
+                    if (!data.success) {
+                        alert(data.message);
+                        return;
+                    }
+                    updateBadge(data);
+                    const line = data.lines[0];
+                    quantity.max = line.available;
+                    button.innerHTML = '<i class="bi bi-cart-check"></i> Agregado';
+                    if (line.available < 1) button.disabled = true;
+                })
+                .catch(error => console.error('Error:', error));
         });
     });
-});
\ No newline at end of file
+});
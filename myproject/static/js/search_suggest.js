@@ -0,0 +1,47 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.querySelector('input[data-suggest-url]');
+    if (!input) return;
+
+    const datalist = document.getElementById(input.getAttribute('list'));
+    const cache = new Map();
+    let timer = null;
+    let controller = null;
+
+    function render(suggestions) {
+        datalist.innerHTML = '';
+        suggestions.forEach(suggestion => {
+            const option = document.createElement('option');
+            option.value = suggestion.text;
+            if (suggestion.type === 'brand') option.label = 'Marca';
+            datalist.appendChild(option);
+        });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const prefix = input.value.trim().toLowerCase();
+        if (prefix.length < 2) {
+            render([]);
+            return;
+        }
+        if (cache.has(prefix)) {
+            render(cache.get(prefix));
+            return;
+        }
+
+        // Wait until typing pauses and drop the request of the previous keystroke
+        timer = setTimeout(function() {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            fetch(input.dataset.suggestUrl + '?q=' + encodeURIComponent(prefix), { signal: controller.signal })
+                .then(response => response.json())
+                .then(data => {
+                    cache.set(prefix, data.suggestions);
+                    if (input.value.trim().toLowerCase() === prefix) render(data.suggestions);
+                })
+                .catch(error => {
+                    if (error.name !== 'AbortError') console.error('Error:', error);
+                });
+        }, 150);
+    });
+});